@@ -1,8 +1,12 @@
+from sqlalchemy import select, update, delete
 from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError, DataError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError, DataError, OperationalError, DBAPIError
 
 from app.utils import error_utils as eu
 from app.utils.general import remove_none_props_from_dict_recursive as rnd
+from app.utils.pagination import Page, split_page
+from app.utils.streaming import STREAM_BATCH_SIZE
 
 
 class Crud:
@@ -22,18 +26,18 @@ class Crud:
         return db.query(cls.orm_model).filter(cls.orm_model.phone == phone)
 
     @classmethod
-    def get_by_id(cls, db: Session, id: int):
-        return cls.get_by_id_query(db, id).first()
+    def get_by_id(cls, db: Session, id: int, options=()):
+        """options: loader options for the relationships the caller will read"""
+        return cls.get_by_id_query(db, id).options(*options).first()
 
     @classmethod
-    def get_by_phone(cls, db: Session, phone: str):
-        return cls.get_by_phone_query(db, phone).first()
+    def get_by_phone(cls, db: Session, phone: str, options=()):
+        return cls.get_by_phone_query(db, phone).options(*options).first()
 
     @classmethod
-    def get_by_email(cls, db: Session, email: str):
-        return (
-            db.query(cls.orm_model).filter(cls.orm_model.email == email.lower()).first()
-        )
+    def get_by_email(cls, db: Session, email: str, options=()):
+        query = db.query(cls.orm_model).filter(cls.orm_model.email == email.lower())
+        return query.options(*options).first()
 
     @classmethod
     def commit_data_to_db(cls, db: Session, data):
@@ -43,42 +47,172 @@ class Crud:
         return data
 
     @classmethod
-    def get_records(cls, db: Session, skip: int, limit: int):
-        return db.query(cls.orm_model).offset(skip).limit(limit).all()
+    def paginate_stmt(cls, stmt, page: Page):
+        """Applies keyset pagination on the primary key to a select statement"""
+        model = cls.orm_model
+        stmt = stmt.where(model.id > page.after_id).order_by(model.id)
+        return stmt.limit(page.fetch_size)
 
     @classmethod
-    def update_by_id(cls, db: Session, id: int, data: dict, table: str):
-        query = cls.get_by_id_query(db, id)
+    def get_records(cls, db: Session, page: Page, options=()):
+        """Returns a page of records and the cursor to the next page"""
+        stmt = cls.paginate_stmt(select(cls.orm_model).options(*options), page)
+        return split_page(db.scalars(stmt).all(), page)
+
+    @classmethod
+    def stream_stmt(cls, after_id: int = 0):
+        """Select streamed through a server-side cursor, STREAM_BATCH_SIZE at a time"""
+        model = cls.orm_model
+        stmt = select(model).where(model.id > after_id).order_by(model.id)
+        return stmt.execution_options(yield_per=STREAM_BATCH_SIZE)
+
+    @classmethod
+    def stream_records(cls, db: Session, after_id: int = 0):
+        """Lazily yields batches of records without loading the whole table"""
+        yield from db.scalars(cls.stream_stmt(after_id)).partitions()
+
+    @classmethod
+    def update_by_id_stmt(cls, id: int, data: dict):
+        """UPDATE ... RETURNING the updated row, an empty result means not found"""
+        model = cls.orm_model
+        return update(model).where(model.id == id).values(rnd(data)).returning(model)
 
-        if query.first() is None:
-            message = f"There is no {table.rstrip('s')} with an id {id}"
-            eu.RaiseHttpException.bad_request(message)
+    @classmethod
+    def delete_by_id_stmt(cls, id: int):
+        """DELETE ... RETURNING the deleted id, an empty result means not found"""
+        model = cls.orm_model
+        return delete(model).where(model.id == id).returning(model.id)
 
+    @classmethod
+    def update_by_id(cls, db: Session, id: int, data: dict, table: str):
         try:
-            query.update(rnd(data), synchronize_session=False)
+            updated = db.scalars(cls.update_by_id_stmt(id, data)).first()
 
         except IntegrityError as e:
-            if 'users_' in str(e):  # An error in updating users table
-                eu.handle_users_integrity_exception(str(e))
-            else:
-                msg = 'The data violates set constraints. Check the data and try again'
-                eu.RaiseHttpException.bad_request(msg)
+            cls.handle_update_integrity_error(e)
 
         except (DataError, OperationalError):
-            msg = "Could not perform the update operation. Please try again!"
-            eu.RaiseHttpException.server_error(msg)
+            cls.handle_update_operational_error()
 
-        else:
-            db.commit()
-            return cls.get_by_id(db, id)
+        if updated is None:
+            cls.handle_update_not_found(id, table)
+
+        db.commit()
+        return updated
 
     @classmethod
     def delete_by_id(cls, db: Session, id: int, table: str = "record"):
-        query = cls.get_by_id_query(db, id)
+        if db.execute(cls.delete_by_id_stmt(id)).scalar() is None:
+            cls.handle_delete_not_found(table)
+
+        db.commit()
 
-        if query.first() is None:
-            msg = f"This {table.rstrip('s')} doesn't exist."
+    @classmethod
+    def handle_update_not_found(cls, id: int, table: str):
+        message = f"There is no {table.rstrip('s')} with an id {id}"
+        eu.RaiseHttpException.bad_request(message)
+
+    @classmethod
+    def handle_delete_not_found(cls, table: str):
+        msg = f"This {table.rstrip('s')} doesn't exist."
+        eu.RaiseHttpException.bad_request(msg)
+
+    @classmethod
+    def handle_update_integrity_error(cls, e: IntegrityError):
+        if 'users_' in str(e):  # An error in updating users table
+            eu.handle_users_integrity_exception(str(e))
+        else:
+            msg = 'The data violates set constraints. Check the data and try again'
             eu.RaiseHttpException.bad_request(msg)
 
-        query.delete()
-        db.commit()
+    @classmethod
+    def handle_update_operational_error(cls):
+        msg = "Could not perform the update operation. Please try again!"
+        eu.RaiseHttpException.server_error(msg)
+
+    # ------------------------------- ASYNC VARIANTS -------------------------------
+
+    @classmethod
+    def get_by_id_stmt(cls, id: int, options=()):
+        return select(cls.orm_model).where(cls.orm_model.id == id).options(*options)
+
+    @classmethod
+    async def async_create(cls, db: AsyncSession, data):
+        new_data = cls.orm_model(**data.__dict__)
+        return await cls.async_commit_data_to_db(db=db, data=new_data)
+
+    @classmethod
+    async def async_commit_data_to_db(cls, db: AsyncSession, data):
+        db.add(data)
+        await db.commit()
+        await db.refresh(data)
+        return data
+
+    @classmethod
+    async def async_get_by_id(cls, db: AsyncSession, id: int, options=()):
+        """
+        options: loader options for the relationships the caller will read, async
+        sessions can't lazy load them later
+        """
+        return (await db.scalars(cls.get_by_id_stmt(id, options))).first()
+
+    @classmethod
+    def owner_id_stmt(cls, id: int):
+        """SELECT the id of the user owning the record, no row means not found"""
+        return select(cls.orm_model.owner_id).where(cls.orm_model.id == id)
+
+    @classmethod
+    async def async_get_owner_id(cls, db: AsyncSession, id: int) -> int | None:
+        return await db.scalar(cls.owner_id_stmt(id))
+
+    @classmethod
+    async def async_get_by_phone(cls, db: AsyncSession, phone: str, options=()):
+        stmt = select(cls.orm_model).where(cls.orm_model.phone == phone)
+        return (await db.scalars(stmt.options(*options))).first()
+
+    @classmethod
+    async def async_get_by_email(cls, db: AsyncSession, email: str, options=()):
+        stmt = select(cls.orm_model).where(cls.orm_model.email == email.lower())
+        return (await db.scalars(stmt.options(*options))).first()
+
+    @classmethod
+    async def async_get_records(cls, db: AsyncSession, page: Page, options=()):
+        """Returns a page of records and the cursor to the next page"""
+        stmt = cls.paginate_stmt(select(cls.orm_model).options(*options), page)
+        return split_page((await db.scalars(stmt)).all(), page)
+
+    @classmethod
+    async def async_stream_records(cls, db: AsyncSession, after_id: int = 0):
+        """Lazily yields batches of records without loading the whole table"""
+        result = await db.stream_scalars(cls.stream_stmt(after_id))
+        async for records in result.partitions():
+            yield records
+
+    @classmethod
+    async def async_update_by_id(
+        cls, db: AsyncSession, id: int, data: dict, table: str
+    ):
+        try:
+            updated = (await db.scalars(cls.update_by_id_stmt(id, data))).first()
+
+        except IntegrityError as e:
+            await db.rollback()
+            cls.handle_update_integrity_error(e)
+
+        except DBAPIError:
+            # asyncpg errors other than integrity ones surface as plain DBAPIError
+            await db.rollback()
+            cls.handle_update_operational_error()
+
+        if updated is None:
+            cls.handle_update_not_found(id, table)
+
+        await db.commit()
+        return updated
+
+    @classmethod
+    async def async_delete_by_id(cls, db: AsyncSession, id: int, table: str = "record"):
+        if (await db.execute(cls.delete_by_id_stmt(id))).scalar() is None:
+            cls.handle_delete_not_found(table)
+
+        await db.commit()
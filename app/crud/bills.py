@@ -1,10 +1,12 @@
+from sqlalchemy import select, delete
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.crud.base_crud import Crud
-from app.models import Bill
+from app.models import Bill, UserBalanceSummary
 from app.schema import bill_payment as bp
-from app.utils.custom_exceptions import CreatePaymentException
 from app.utils.error_utils import RaiseHttpException
+from app.utils.pagination import Page, split_page
 
 
 class BillCrud(Crud):
@@ -15,43 +17,60 @@ class BillCrud(Crud):
         return super().create(db, data=bill)
 
     @classmethod
-    def init_bill_payment_transaction(cls, db: Session, payment: bp.PaymentCreate):
-        bill: bp.BillOut = cls.get_by_id(db=db, id=payment.bill_id)
+    def owner_id_stmt(cls, id: int):
+        return select(cls.orm_model.user_id).where(cls.orm_model.id == id)
 
-        if bill is None:
-            error_msg = f"There is no bill with the id {payment.bill_id}"
-            raise CreatePaymentException(error_msg)
+    @classmethod
+    def delete_paid_bill_stmt(cls, id: int, user_id: int = None):
+        """
+        DELETE ... RETURNING user_id of a fully paid bill, optionally owned by user_id
+        """
+        model = cls.orm_model
+        stmt = delete(model).where(model.id == id, model.paid.is_(True))
+
+        if user_id is not None:
+            stmt = stmt.where(model.user_id == user_id)
 
-        query = cls.get_by_id_query(db=db, id=payment.bill_id)
+        return stmt.returning(model.user_id)
 
-        def add_payment_amount(payment_amount: float, bill_amount) -> float:
-            return payment_amount + float(bill_amount)
+    @classmethod
+    def handle_failed_delete(cls, bill: Bill | None, user_id: int = None):
+        if bill is None:
+            RaiseHttpException.not_found("This bill does not exist")
 
-        to_update = {}
-        if payment.issuer == "user":
-            to_update["total_paid_amount"] = add_payment_amount(
-                payment.amount, bill.total_paid_amount
-            )
+        if user_id is not None and bill.user_id != user_id:
+            RaiseHttpException.forbidden("You can only delete your bills")
 
-        if payment.issuer == "creditor":
-            to_update["total_credit_amount"] = add_payment_amount(
-                payment.amount, bill.total_credit_amount
-            )
+        RaiseHttpException.forbidden("The bill has an outstanding debt")
 
-        query.update(to_update)
+    # ------------------------------- ASYNC VARIANTS -------------------------------
 
     @classmethod
-    def get_bills_for_user(cls, db: Session, user_id: int) -> list[Bill] | list:
-        return db.query(cls.orm_model).filter(cls.orm_model.user_id == user_id).all()
+    def bills_page_for_user_stmt(cls, user_id: int, page: Page):
+        stmt = select(cls.orm_model).where(cls.orm_model.user_id == user_id)
+        return cls.paginate_stmt(stmt, page)
 
     @classmethod
-    def delete_by_id(cls, db: Session, id: int):
-        bill: Bill = super().get_by_id(db, id)
+    async def async_get_bills_page_for_user(
+        cls, db: AsyncSession, user_id: int, page: Page
+    ) -> tuple[list[Bill], str | None]:
+        stmt = cls.bills_page_for_user_stmt(user_id, page)
+        return split_page((await db.scalars(stmt)).all(), page)
 
-        if bill is None:
-            RaiseHttpException.not_found("This bill does not exist")
+    @classmethod
+    async def async_get_balance_summary(
+        cls, db: AsyncSession, user_id: int
+    ) -> UserBalanceSummary | None:
+        """The user's totals over all bills, None until the user's first bill"""
+        return await db.get(UserBalanceSummary, user_id)
+
+    @classmethod
+    async def async_delete_by_id(cls, db: AsyncSession, id: int, user_id: int = None):
+        stmt = cls.delete_paid_bill_stmt(id, user_id)
+        owner_id = (await db.execute(stmt)).scalar()
 
-        if not bill.paid:
-            RaiseHttpException.forbidden("The bill has an outstanding debt")
+        if owner_id is None:
+            # Only a failed delete pays for the lookup explaining why it failed
+            cls.handle_failed_delete(await cls.async_get_by_id(db, id), user_id)
 
-        super().delete_by_id(db, id)
+        await db.commit()
@@ -1,10 +1,13 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.crud.base_crud import Crud
 from app.models import Creditor
-from app.schema.creditor import CreditorCreate
-from app.utils.general import title_case_words
-from app.utils.raw_sql_operators import execute_query, map_to_creditor
+from app.schema.creditor import CreditorCreate, MyCreditorOut
+from app.utils.general import initcap_words
+from app.utils.pagination import Page, split_page
+from app.utils.raw_sql_operators import execute_query
 
 
 class CreditorCrud(Crud):
@@ -12,19 +15,17 @@ class CreditorCrud(Crud):
 
     @classmethod
     def process(cls, creditor: CreditorCreate):
-        creditor.name = title_case_words(creditor.name)
-        creditor.city = title_case_words(creditor.city)
-        creditor.state = title_case_words(creditor.state)
-        creditor.country = (
-            title_case_words(creditor.country) if creditor.country else None
-        )
+        creditor.name = initcap_words(creditor.name)
+        creditor.city = initcap_words(creditor.city)
+        creditor.state = initcap_words(creditor.state)
+        creditor.country = initcap_words(creditor.country) if creditor.country else None
         creditor.bank_name = (
-            title_case_words(creditor.bank_name) if creditor.bank_name else None
+            initcap_words(creditor.bank_name) if creditor.bank_name else None
         )
         creditor.country = creditor.country if creditor.country else None
 
         creditor.bank_name = (
-            title_case_words(creditor.bank_name) if creditor.bank_name else None
+            initcap_words(creditor.bank_name) if creditor.bank_name else None
         )
 
         return creditor
@@ -38,11 +39,42 @@ class CreditorCrud(Crud):
         return db.query(cls.orm_model).filter(cls.orm_model.name == name).first()
 
     @classmethod
-    def get_creditors_for_user(cls, user_id: int):
+    async def async_create(cls, db: AsyncSession, creditor: CreditorCreate) -> Creditor:
+        return await super().async_create(db, data=cls.process(creditor))
+
+    @classmethod
+    async def async_get_creditor_by_name(cls, db: AsyncSession, name: str):
+        stmt = select(cls.orm_model).where(cls.orm_model.name == name)
+        return (await db.scalars(stmt)).first()
+
+    @staticmethod
+    def user_creditors_query(limited: bool = True) -> str:
+        """The user's creditors after a given id, LIMITed to a page when limited"""
+        return f"""
+            SELECT * FROM creditors
+            WHERE owner_id = %(id)s AND id > %(after_id)s
+            ORDER BY id{" LIMIT %(limit)s" if limited else ""}
+        """
+
+    @classmethod
+    def get_creditors_for_user(cls, db: Session, user_id: int, page: Page):
         user_creditors = execute_query(
-            query="SELECT * FROM creditors WHERE owner_id = %(id)s;",
-            params={"id": user_id},
-            mapper=map_to_creditor,
+            db=db,
+            query=cls.user_creditors_query(),
+            params={"id": user_id, "after_id": page.after_id, "limit": page.fetch_size},
+            schema=MyCreditorOut,
+            batch_size=page.fetch_size,
+            server_side=False,
         )
 
-        return next(user_creditors)
+        return split_page(next(user_creditors, []), page)
+
+    @classmethod
+    def stream_creditors_for_user(cls, db: Session, user_id: int, after_id: int = 0):
+        """Lazily yields batches of all the user's creditors after after_id"""
+        return execute_query(
+            db=db,
+            query=cls.user_creditors_query(limited=False),
+            params={"id": user_id, "after_id": after_id},
+            schema=MyCreditorOut,
+        )
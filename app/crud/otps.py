@@ -0,0 +1,138 @@
+from datetime import timedelta
+from sqlalchemy import select, delete, func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.crud.base_crud import Crud
+from app.models import Otp
+from app.utils import auth as au
+from app.utils.error_utils import RaiseHttpException
+
+OTP_DIGITS = 5
+OTP_ISSUE_ATTEMPTS = 5
+
+
+class OtpCrud(Crud):
+    orm_model = Otp
+
+    @classmethod
+    def issue_stmt(cls, user_id: int, purpose: str, code_hash: str, minutes: int):
+        """
+        INSERT ... RETURNING id of a new otp. Nothing is returned when a live otp
+        has the same hash, an expired one is taken over.
+        """
+        model = cls.orm_model
+        stmt = insert(model).values(
+            user_id=user_id,
+            purpose=purpose,
+            code_hash=code_hash,
+            expires_at=func.now() + timedelta(minutes=minutes),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[model.code_hash],
+            set_={
+                "user_id": stmt.excluded.user_id,
+                "purpose": stmt.excluded.purpose,
+                "expires_at": stmt.excluded.expires_at,
+                "created_at": func.now(),
+            },
+            where=model.expires_at <= func.now(),
+        )
+        return stmt.returning(model.id)
+
+    @classmethod
+    def issue(cls, db: Session, user_id: int, purpose: str, minutes: int = 5) -> str:
+        """
+        Replaces the user's pending otps for the purpose with a new one
+
+        Returns:
+            str: The plain otp to be sent to the user
+        """
+        model = cls.orm_model
+        db.execute(
+            delete(model).where(model.user_id == user_id, model.purpose == purpose)
+        )
+
+        for _ in range(OTP_ISSUE_ATTEMPTS):
+            otp = au.generate_otp(OTP_DIGITS)
+            stmt = cls.issue_stmt(user_id, purpose, au.hash_otp(otp, purpose), minutes)
+
+            if db.scalar(stmt) is not None:
+                db.commit()
+                return otp
+
+        db.rollback()
+        RaiseHttpException.server_error("Error while creating the one time password")
+
+    @classmethod
+    async def async_issue(
+        cls, db: AsyncSession, user_id: int, purpose: str, minutes: int = 5
+    ) -> str:
+        """
+        Replaces the user's pending otps for the purpose with a new one
+
+        Returns:
+            str: The plain otp to be sent to the user
+        """
+        model = cls.orm_model
+        await db.execute(
+            delete(model).where(model.user_id == user_id, model.purpose == purpose)
+        )
+
+        for _ in range(OTP_ISSUE_ATTEMPTS):
+            otp = au.generate_otp(OTP_DIGITS)
+            stmt = cls.issue_stmt(user_id, purpose, au.hash_otp(otp, purpose), minutes)
+
+            if await db.scalar(stmt) is not None:
+                await db.commit()
+                return otp
+
+        await db.rollback()
+        RaiseHttpException.server_error("Error while creating the one time password")
+
+    @classmethod
+    def consume_stmt(cls, otp: str, purposes: list[str], user_id: int = None):
+        """
+        DELETE ... RETURNING user_id of a live otp issued for one of the purposes,
+        only to user_id when given. Built on the table so it can be embedded as a
+        CTE.
+        """
+        otps = cls.orm_model.__table__
+        hashes = [au.hash_otp(otp, purpose) for purpose in purposes]
+        stmt = delete(otps).where(
+            otps.c.code_hash.in_(hashes), otps.c.expires_at > func.now()
+        )
+        if user_id is not None:
+            stmt = stmt.where(otps.c.user_id == user_id)
+        return stmt.returning(otps.c.user_id)
+
+    @classmethod
+    def consume(cls, db: Session, otp: str, purposes: list[str], user_id: int) -> bool:
+        """
+        Consumes the user's otp issued for one of the purposes, False if the user
+        has no such live otp. The otp is only gone for good once the transaction
+        is committed.
+        """
+        return db.scalar(cls.consume_stmt(otp, purposes, user_id)) is not None
+
+    @classmethod
+    def purge_expired_stmt(cls, batch_size: int):
+        model = cls.orm_model
+        expired_ids = (
+            select(model.id)
+            .where(model.expires_at <= func.now())
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        return delete(model).where(model.id.in_(expired_ids.scalar_subquery()))
+
+    @classmethod
+    async def async_purge_expired(cls, db: AsyncSession, batch_size: int) -> int:
+        """Deletes up to batch_size expired otps and returns how many were deleted"""
+        result = await db.execute(
+            cls.purge_expired_stmt(batch_size),
+            execution_options={"synchronize_session": False},
+        )
+        await db.commit()
+        return result.rowcount
@@ -1,11 +1,29 @@
+import sqlalchemy as sa
+from decimal import Decimal
+from datetime import datetime, timezone
 from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import REGCLASS
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.crud.base_crud import Crud
-from app.crud.bills import BillCrud
-from app.models import Payment
-from app.schema.bill_payment import PaymentCreate, PaymentOut
+from app.models import Bill, Payment, Creditor, UserBalanceSummary
+from app.settings import settings
+from app.schema.bill_payment import PaymentCreate, PaymentOut, PaymentBatchItem
+from app.schema.bill_payment import PaymentBatchItemResult
 from app.utils.custom_exceptions import CreatePaymentException
-from app.utils.raw_sql_operators import execute_query, map_to_payment
+from app.utils.pagination import Page, split_page
+from app.utils.raw_sql_operators import execute_query
+from app.utils.cache import TTLCache
+from app.utils import time_buckets as tb
+
+# Payment totals of closed buckets by (user_id, analytics_version, bucket), then by
+# bucket start. Past buckets only change when one of the user's bills is deleted,
+# which bumps the user's analytics_version in the database: every worker then
+# misses the entries of the old version, left to expire. Creditor names change
+# and are joined on every read.
+analytics_cache = TTLCache(
+    maxsize=settings.analytics_cache_max_size, ttl=settings.analytics_cache_ttl_secs
+)
 
 
 class PaymentCrud(Crud):
@@ -19,24 +37,361 @@ class PaymentCrud(Crud):
         return payment
 
     @classmethod
-    def create(cls, db: Session, payment: PaymentCreate) -> Payment:
-        """Handles a bills payments transaction"""
+    def create_stmt(cls, payment: PaymentCreate, user_id: int = None):
+        """
+        Builds a single atomic statement that records a payment on its bill
+
+        WITH paid_bill AS (
+            UPDATE bills SET total_<issuer>_amount = total_<issuer>_amount + :amount
+            WHERE id = :bill_id [AND user_id = :user_id] RETURNING id
+        )
+        INSERT INTO payments (...) SELECT paid_bill.id, ... FROM paid_bill RETURNING *
+
+        The bill row is locked by the UPDATE, so concurrent payments on the same
+        bill queue up instead of overwriting each other's totals. No row is
+        returned when the bill doesn't exist or isn't owned by user_id.
+        """
+        bills, payments = Bill.__table__, Payment.__table__
+        amount = Decimal(str(payment.amount))
+
+        if payment.issuer == "user":
+            total = bills.c.total_paid_amount
+        else:
+            total = bills.c.total_credit_amount
+
+        paid_bill = sa.update(bills).where(bills.c.id == payment.bill_id)
+        if user_id is not None:
+            paid_bill = paid_bill.where(bills.c.user_id == user_id)
+        paid_bill = paid_bill.values({total: total + amount})
+        paid_bill = paid_bill.returning(bills.c.id).cte("paid_bill")
+
+        payment_values = sa.select(
+            paid_bill.c.id,
+            sa.cast(sa.literal(payment.note), payments.c.note.type),
+            sa.cast(sa.literal(payment.issuer), payments.c.issuer.type),
+            sa.cast(sa.literal(amount), payments.c.amount.type),
+        )
+        columns = ["bill_id", "note", "issuer", "amount"]
+        stmt = sa.insert(payments).from_select(columns, payment_values)
+        stmt = stmt.add_cte(paid_bill).returning(*payments.c)
+
+        return sa.select(cls.orm_model).from_statement(stmt)
+
+    @classmethod
+    def owner_id_stmt(cls, id: int):
+        """SELECT the user_id of the bill the payment was made to"""
+        return (
+            sa.select(Bill.user_id)
+            .join(cls.orm_model, cls.orm_model.bill_id == Bill.id)
+            .where(cls.orm_model.id == id)
+        )
+
+    @classmethod
+    def handle_no_bill(cls, payment: PaymentCreate, user_id: int = None):
+        if user_id is None:
+            error_msg = f"There is no bill with the id {payment.bill_id}"
+        else:
+            error_msg = f"You have no bill with the id {payment.bill_id}"
+        raise CreatePaymentException(error_msg)
+
+    @classmethod
+    async def async_create(
+        cls, db: AsyncSession, payment: PaymentCreate, user_id: int = None
+    ) -> Payment:
+        """Handles a bills payments transaction
+
+        Args:
+            user_id (int): When given, the bill must belong to this user
+        """
+
+        stmt = cls.create_stmt(cls.process(payment=payment), user_id)
+        db_payment = (await db.scalars(stmt)).first()
+
+        if db_payment is None:
+            cls.handle_no_bill(payment, user_id)
+
+        await db.commit()
+        return db_payment
+
+    @classmethod
+    def lock_bills_stmt(cls, bill_ids: list[int]):
+        """
+        SELECT ... FOR UPDATE of the bills in id order, so concurrent batches over
+        the same bills queue up instead of deadlocking
+        """
+        bills = Bill.__table__
+        stmt = sa.select(bills.c.id).where(bills.c.id.in_(sorted(bill_ids)))
+        return stmt.order_by(bills.c.id).with_for_update()
+
+    @classmethod
+    def apply_bill_deltas_stmt(cls, deltas: dict[int, list[Decimal]]):
+        """
+        One set based UPDATE adding the aggregated amounts to each bill. The bills
+        must be locked with lock_bills_stmt first
+
+        UPDATE bills SET total_paid_amount = total_paid_amount + deltas.paid, ...
+        FROM (VALUES (:bill_id, :paid, :credit), ...) AS deltas
+        WHERE bills.id = deltas.bill_id RETURNING bills.id
+        """
+        bills = Bill.__table__
+        deltas_table = sa.values(
+            sa.column("bill_id", sa.Integer),
+            sa.column("paid", bills.c.total_paid_amount.type),
+            sa.column("credit", bills.c.total_credit_amount.type),
+            name="deltas",
+        ).data([(bill_id, paid, credit) for bill_id, (paid, credit) in deltas.items()])
+
+        stmt = sa.update(bills).where(bills.c.id == deltas_table.c.bill_id)
+        stmt = stmt.values(
+            total_paid_amount=bills.c.total_paid_amount + deltas_table.c.paid,
+            total_credit_amount=bills.c.total_credit_amount + deltas_table.c.credit,
+        )
+        return stmt.returning(bills.c.id)
+
+    @classmethod
+    def insert_batch_stmt(cls, items: list[tuple[int, dict]]):
+        """
+        Inserts the (item index, payment values) items and SELECTs each index with
+        the id of its payment. The ids are drawn from the sequence next to the
+        indexes, so the pairs don't depend on the order rows are inserted in
+
+        WITH new_payments AS (
+            SELECT items.item_index, nextval(<payments.id sequence>) AS id, ...
+            FROM (VALUES (:item_index, :bill_id, :note, :issuer, :amount), ...)
+            AS items
+        ), inserted AS (
+            INSERT INTO payments (id, ...) SELECT id, ... FROM new_payments
+        )
+        SELECT item_index, id FROM new_payments
+        """
+        payments = Payment.__table__
+        values = sa.values(
+            sa.column("item_index", sa.Integer),
+            sa.column("bill_id", sa.Integer),
+            sa.column("note", sa.Text),
+            sa.column("issuer", sa.String),
+            sa.column("amount", payments.c.amount.type),
+            name="items",
+        ).data(
+            [
+                (index, item["bill_id"], item["note"], item["issuer"], item["amount"])
+                for index, item in items
+            ]
+        )
+
+        sequence = sa.cast(sa.func.pg_get_serial_sequence("payments", "id"), REGCLASS)
+        new_payments = sa.select(
+            values.c.item_index,
+            sa.func.nextval(sequence).label("id"),
+            values.c.bill_id,
+            values.c.note,
+            sa.cast(values.c.issuer, payments.c.issuer.type).label("issuer"),
+            values.c.amount,
+        ).cte("new_payments")
+
+        columns = ["id", "bill_id", "note", "issuer", "amount"]
+        inserted = sa.insert(payments).from_select(
+            columns, sa.select(*(new_payments.c[column] for column in columns))
+        )
+        return sa.select(new_payments.c.item_index, new_payments.c.id).add_cte(
+            inserted.cte("inserted")
+        )
+
+    @classmethod
+    async def async_create_batch(
+        cls, db: AsyncSession, payments: list[PaymentBatchItem]
+    ) -> list[PaymentBatchItemResult]:
+        """
+        Records a batch of payments in a single transaction
+
+        The bills are locked in id order, the per bill totals are applied with one
+        UPDATE, which also tells which bills exist, then the payments on existing
+        bills are inserted with a single INSERT. Items with an invalid issuer or an
+        unknown bill are reported as failed and the rest are still recorded.
+
+        Returns:
+            list[PaymentBatchItemResult]: One result per item, in request order
+        """
+        results = [
+            PaymentBatchItemResult(index=index, success=False)
+            for index in range(len(payments))
+        ]
+        valid: list[tuple[int, PaymentCreate, Decimal]] = []
+        deltas: dict[int, list[Decimal]] = {}
+
+        for index, payment in enumerate(payments):
+            try:
+                cls.process(payment)
+            except CreatePaymentException as e:
+                results[index].error = str(e)
+                continue
+
+            amount = Decimal(str(payment.amount))
+            bill_deltas = deltas.setdefault(payment.bill_id, [Decimal(0), Decimal(0)])
+            bill_deltas[0 if payment.issuer == "user" else 1] += amount
+            valid.append((index, payment, amount))
+
+        existing_bills = set()
+        if deltas:
+            await db.execute(cls.lock_bills_stmt(list(deltas)))
+            stmt = cls.apply_bill_deltas_stmt(deltas)
+            existing_bills = set((await db.scalars(stmt)).all())
+
+        to_insert = []
+        for index, payment, amount in valid:
+            if payment.bill_id not in existing_bills:
+                results[index].error = f"There is no bill with the id {payment.bill_id}"
+                continue
+
+            to_insert.append((index, {**payment.dict(), "amount": amount}))
 
-        processed_payment = cls.process(payment=payment)
-        BillCrud.init_bill_payment_transaction(db=db, payment=payment)
-        db_payment = cls.orm_model(**processed_payment.dict())
-        return cls.commit_data_to_db(db, data=db_payment)
+        if to_insert:
+            inserted = await db.execute(cls.insert_batch_stmt(to_insert))
+
+            for index, id in inserted:
+                results[index].success = True
+                results[index].id = id
+
+        await db.commit()
+        return results
+
+    @staticmethod
+    def user_payments_query(limited: bool = True) -> str:
+        """The user's payments after a given id, LIMITed to a page when limited"""
+        return f"""
+            SELECT * FROM payments WHERE payments.bill_id IN (
+                SELECT id FROM bills WHERE user_id = %(id)s
+            ) AND payments.id > %(after_id)s
+            ORDER BY payments.id{" LIMIT %(limit)s" if limited else ""}
+        """
 
     @classmethod
-    def get_payments_for_user(cls, user_id: int) -> list[PaymentOut]:
+    def get_payments_for_user(
+        cls, db: Session, user_id: int, page: Page
+    ) -> tuple[list[PaymentOut], str | None]:
         user_payments = execute_query(
-            query="""
-                    SELECT * FROM payments WHERE payments.bill_id IN (
-                        SELECT id FROM bills WHERE user_id = %(id)s
-                    );
-                """,
-            params={"id": user_id},
-            mapper=map_to_payment,
+            db=db,
+            query=cls.user_payments_query(),
+            params={"id": user_id, "after_id": page.after_id, "limit": page.fetch_size},
+            schema=PaymentOut,
+            batch_size=page.fetch_size,
+            server_side=False,
+        )
+
+        return split_page(next(user_payments, []), page)
+
+    @classmethod
+    def stream_payments_for_user(cls, db: Session, user_id: int, after_id: int = 0):
+        """Lazily yields batches of all the user's payments after after_id"""
+        return execute_query(
+            db=db,
+            query=cls.user_payments_query(limited=False),
+            params={"id": user_id, "after_id": after_id},
+            schema=PaymentOut,
+        )
+
+    @classmethod
+    def analytics_stmt(cls, user_id: int, bucket: str, start: datetime, end: datetime):
+        """
+        Payment totals per bucket and creditor id of the user's payments made
+        within [start, end), both naive UTC. Buckets are in UTC
+        """
+        assert bucket in tb.BUCKETS, f"bucket must be one of {tb.BUCKETS}"
+        payment = cls.orm_model
+
+        # Literals, with bound parameters the GROUP BY expression wouldn't match
+        # the selected one for postgres
+        utc = sa.literal_column("'UTC'")
+        created_at_utc = sa.func.timezone(utc, payment.created_at)
+        bucket_start = sa.func.date_trunc(
+            sa.literal_column(f"'{bucket}'"), created_at_utc
+        ).label("bucket_start")
+
+        return (
+            sa.select(
+                bucket_start,
+                Bill.creditor_id,
+                sa.func.sum(payment.amount).label("total_amount"),
+                sa.func.count(payment.id).label("payment_count"),
+            )
+            .join(Bill, Bill.id == payment.bill_id)
+            .where(
+                Bill.user_id == user_id,
+                payment.created_at >= start.replace(tzinfo=timezone.utc),
+                payment.created_at < end.replace(tzinfo=timezone.utc),
+            )
+            .group_by(bucket_start, Bill.creditor_id)
+            .order_by(bucket_start, Bill.creditor_id)
         )
 
-        return next(user_payments)
+    @classmethod
+    async def async_aggregate(
+        cls, db: AsyncSession, user_id: int, bucket: str, start: datetime, end: datetime
+    ) -> list[dict]:
+        result = await db.execute(cls.analytics_stmt(user_id, bucket, start, end))
+        return [dict(row._mapping) for row in result]
+
+    @classmethod
+    def analytics_version_stmt(cls, user_id: int):
+        """No row until the user's first bill, version 0"""
+        summary = UserBalanceSummary
+        return sa.select(summary.analytics_version).where(summary.user_id == user_id)
+
+    @classmethod
+    async def async_get_creditor_names(
+        cls, db: AsyncSession, creditor_ids: set[int]
+    ) -> dict[int, str]:
+        stmt = sa.select(Creditor.id, Creditor.name)
+        stmt = stmt.where(Creditor.id.in_(sorted(creditor_ids)))
+        return dict((await db.execute(stmt)).all())
+
+    @classmethod
+    async def async_get_analytics(
+        cls, db: AsyncSession, user_id: int, bucket: str, start: datetime, end: datetime
+    ) -> list[dict]:
+        """
+        Returns the user's payment totals per bucket and creditor for every bucket
+        overlapping [start, end), in full. Closed buckets come from the analytics
+        cache when possible, the open bucket is always aggregated afresh.
+        """
+        # Read first, the totals aggregated next are at least as recent
+        version = await db.scalar(cls.analytics_version_stmt(user_id)) or 0
+        cache_key = (user_id, version, bucket)
+
+        starts = tb.bucket_starts(tb.to_naive_utc(start), tb.to_naive_utc(end), bucket)
+        open_start = tb.bucket_start(datetime.utcnow(), bucket)
+        closed = analytics_cache.get(cache_key) or {}
+
+        # One query covering every closed bucket not cached yet
+        missing = [s for s in starts if s < open_start and s not in closed]
+        if missing:
+            closed = dict(closed)  # Other requests may be reading the cached one
+            span_end = tb.next_bucket_start(missing[-1], bucket)
+            rows = await cls.async_aggregate(db, user_id, bucket, missing[0], span_end)
+
+            for start_of_bucket in tb.bucket_starts(missing[0], span_end, bucket):
+                closed[start_of_bucket] = []
+            for row in rows:
+                closed[row["bucket_start"]].append(row)
+
+            analytics_cache.set(cache_key, closed)
+
+        aggregates = [row for s in starts if s < open_start for row in closed[s]]
+
+        if open_start in starts:
+            open_end = tb.next_bucket_start(open_start, bucket)
+            aggregates += await cls.async_aggregate(
+                db, user_id, bucket, open_start, open_end
+            )
+
+        if not aggregates:
+            return []
+
+        creditor_ids = {row["creditor_id"] for row in aggregates}
+        names = await cls.async_get_creditor_names(db, creditor_ids)
+        # A creditor missing by now went along with its deleted bill
+        return [
+            {**row, "creditor_name": names[row["creditor_id"]]}
+            for row in aggregates
+            if row["creditor_id"] in names
+        ]
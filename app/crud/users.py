@@ -1,23 +1,30 @@
-from bcrypt import gensalt, hashpw
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import IntegrityError, DataError, OperationalError
+from sqlalchemy import select, update
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.exc import IntegrityError, DBAPIError
 
 from app.crud.base_crud import Crud
+from app.crud.otps import OtpCrud
 from app.models import User as UserOrm
+from app.settings import settings
+from app.utils import auth as au
+from app.utils.cache import TTLCache
 from app.utils.general import title_case_words
 from app.schema.user import UserCreate
 from app.utils.error_utils import RaiseHttpException
 from app.utils.error_utils import handle_users_integrity_exception
 
+# Authenticated users by id, for this worker only. Writes through UserCrud evict
+# the user here, writes handled by other workers are picked up within the ttl.
+user_cache = TTLCache(
+    maxsize=settings.user_cache_max_size, ttl=settings.user_cache_ttl_secs
+)
+
 
 class UserCrud(Crud):
     orm_model = UserOrm
 
-    @classmethod
-    def __hash_password(cls, password: str) -> bytes:
-        password_bytes = password.encode("utf-8")
-        return hashpw(password_bytes, gensalt())
-
     @classmethod
     def process(cls, user: UserCreate):
         user.first_name = title_case_words(user.first_name)
@@ -27,7 +34,7 @@ class UserCrud(Crud):
         user.last_name = title_case_words(user.last_name)
 
         if user.password:
-            user.password = cls.__hash_password(user.password)
+            user.password = au.hash_password(user.password)
 
         if user.email:
             user.email = user.email.lower()
@@ -38,32 +45,133 @@ class UserCrud(Crud):
         return super().create(db, data=cls.process(user))
 
     @classmethod
-    def get_user_by_otp(cls, db: Session, otp: str) -> UserOrm:
+    def verify_user_by_otp(cls, db: Session, otp: str) -> UserOrm | None:
+        """Consumes a login otp and marks its user verified in a single statement"""
         model = cls.orm_model
-        return db.query(model).filter(model.otp == otp).first()
+        consumed = OtpCrud.consume_stmt(otp, ["login"]).cte("consumed_otp")
+        stmt = (
+            update(model)
+            .where(model.id == consumed.c.user_id)
+            .values(verified=True)
+            .returning(model)
+        )
+        user = db.scalars(select(model).from_statement(stmt)).first()
+        db.commit()
+
+        if user is not None:
+            user_cache.pop(user.id)
+        return user
 
     @classmethod
-    def update_user_by_phone(cls, db: Session, phone: str, update_data: dict):
-        query = super().get_by_phone_query(db, phone)
+    def update_by_phone_stmt(cls, phone: str, update_data: dict):
+        model = cls.orm_model
+        stmt = update(model).where(model.phone == phone).values(update_data)
+        return stmt.returning(model)
 
-        try:
-            query.update(update_data)
-        except IntegrityError as e:
-            handle_users_integrity_exception(str(e))
-        except (DataError, OperationalError):
-            RaiseHttpException.server_error()
-        else:
-            db.commit()
-            return super().get_by_phone(db, phone)
+    @classmethod
+    def update_by_id(cls, db: Session, id: int, data: dict, table: str):
+        updated = super().update_by_id(db, id, data, table)
+        user_cache.pop(id)
+        return updated
 
     @classmethod
     def update_user_password(cls, db: Session, user_id: int, new_password: str):
-        hashed_password = cls.__hash_password(password=new_password)
+        hashed_password = au.hash_password(new_password)
         super().get_by_id_query(db=db, id=user_id).update({"password": hashed_password})
         db.commit()
+        user_cache.pop(user_id)
 
     @classmethod
     def delete_me(cls, db: Session, id: int):
         query = super().get_by_id_query(db=db, id=id)
         query.update({"is_active": False})
         db.commit()
+        user_cache.pop(id)
+
+    @classmethod
+    def delete_by_id(cls, db: Session, id: int, table: str = "record"):
+        super().delete_by_id(db, id, table)
+        user_cache.pop(id)
+
+    @classmethod
+    def cache_copy(cls, user: UserOrm) -> UserOrm:
+        """
+        Returns a detached copy of the user's columns, safe to share between
+        sessions and to bring into one with session.merge(copy, load=False)
+        """
+        columns = inspect(cls.orm_model).column_attrs
+        copy = cls.orm_model(**{c.key: getattr(user, c.key) for c in columns})
+        make_transient_to_detached(copy)
+        return copy
+
+    # ------------------------------- ASYNC VARIANTS -------------------------------
+
+    @classmethod
+    async def async_update_user_by_phone(
+        cls, db: AsyncSession, phone: str, update_data: dict
+    ):
+        stmt = cls.update_by_phone_stmt(phone, update_data)
+
+        try:
+            user = (await db.scalars(stmt)).first()
+        except IntegrityError as e:
+            await db.rollback()
+            handle_users_integrity_exception(str(e))
+        except DBAPIError:
+            # asyncpg errors other than integrity ones surface as plain DBAPIError
+            await db.rollback()
+            RaiseHttpException.server_error()
+        else:
+            await db.commit()
+            user is not None and user_cache.pop(user.id)
+            return user
+
+    @classmethod
+    async def async_update_by_id(
+        cls, db: AsyncSession, id: int, data: dict, table: str
+    ):
+        updated = await super().async_update_by_id(db, id, data, table)
+        user_cache.pop(id)
+        return updated
+
+    @classmethod
+    async def async_update_user_password(
+        cls, db: AsyncSession, user_id: int, new_password: str
+    ):
+        hashed_password = await au.async_hash_password(new_password)
+        stmt = update(cls.orm_model).where(cls.orm_model.id == user_id)
+        await db.execute(stmt.values(password=hashed_password))
+        await db.commit()
+        user_cache.pop(user_id)
+
+    @classmethod
+    async def async_delete_me(cls, db: AsyncSession, id: int):
+        stmt = update(cls.orm_model).where(cls.orm_model.id == id)
+        await db.execute(stmt.values(is_active=False))
+        await db.commit()
+        user_cache.pop(id)
+
+    @classmethod
+    async def async_images_in_use(cls, db: AsyncSession, image_names: set[str]):
+        """Returns the given image names that some user's image_url refers to"""
+        image_url = cls.orm_model.image_url
+        stmt = select(image_url).where(image_url.in_(image_names)).distinct()
+        return set(await db.scalars(stmt))
+
+    @classmethod
+    async def async_get_cached_by_id(cls, db: AsyncSession, id: int):
+        """
+        Returns the user from the worker's user cache, falling back to the database.
+        A cached user is merged into db without a query, so it behaves like a
+        loaded one for the rest of the request. The loaded user isn't cached if
+        an update evicted it while it was being loaded.
+        """
+        cached = user_cache.get(id)
+        if cached is not None:
+            return await db.merge(cached, load=False)
+
+        generation = user_cache.generation(id)
+        user = await cls.async_get_by_id(db, id)
+        if user is not None:
+            user_cache.set(id, cls.cache_copy(user), generation=generation)
+        return user
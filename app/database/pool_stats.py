@@ -0,0 +1,99 @@
+import time
+from threading import Lock
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+
+class PoolMonitor:
+    """Collects checkout, connect and wait time statistics for a connection pool"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self._lock = Lock()
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_total_secs = 0.0
+        self.wait_max_secs = 0.0
+
+    def _increment(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def record_wait(self, secs: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_total_secs += secs
+            self.wait_max_secs = max(self.wait_max_secs, secs)
+            if timed_out:
+                self.timeouts += 1
+
+    def watch(self, pool: QueuePool):
+        """Registers the event hooks on the pool and returns the pool"""
+        pool._monitor = self
+
+        event.listen(pool, "connect", lambda *args: self._increment("connects"))
+        event.listen(pool, "checkout", lambda *args: self._increment("checkouts"))
+        event.listen(pool, "checkin", lambda *args: self._increment("checkins"))
+        event.listen(pool, "invalidate", lambda *args: self._increment("invalidations"))
+        return pool
+
+    def snapshot(self, pool: QueuePool) -> dict:
+        with self._lock:
+            avg_wait = self.wait_total_secs / self.wait_count if self.wait_count else 0
+            return {
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,
+                "total_checkouts": self.checkouts,
+                "total_checkins": self.checkins,
+                "total_connects": self.connects,
+                "total_invalidations": self.invalidations,
+                "total_timeouts": self.timeouts,
+                "avg_wait_ms": round(avg_wait * 1000, 3),
+                "max_wait_ms": round(self.wait_max_secs * 1000, 3),
+            }
+
+
+class MonitoredPoolMixin:
+    """Times how long callers wait to get a connection out of the pool"""
+
+    _monitor: PoolMonitor = None
+
+    def connect(self):
+        started = time.perf_counter()
+        timed_out = False
+
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            if self._monitor is not None:
+                self._monitor.record_wait(time.perf_counter() - started, timed_out)
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool. The event hooks are carried over
+        # by sqlalchemy, the wait time monitor is not.
+        pool = super().recreate()
+        pool._monitor = self._monitor
+        return pool
+
+
+class MonitoredQueuePool(MonitoredPoolMixin, QueuePool):
+    pass
+
+
+class MonitoredAsyncQueuePool(MonitoredPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+sync_pool_monitor = PoolMonitor("sync")
+async_pool_monitor = PoolMonitor("async")
@@ -1,12 +1,10 @@
-from psycopg2 import connect
-from app.settings import settings
+from app.database.sqlalchemy_config import engine
 
 
 def get_connection():
-    return connect(
-        database=settings.db_name,
-        user=settings.db_username,
-        password=settings.db_password,
-        port=settings.db_port,
-        host=settings.db_host,
-    )
+    """
+    Checks out a raw psycopg2 connection from the sqlalchemy pool
+
+    Closing the connection returns it to the pool instead of disconnecting
+    """
+    return engine.raw_connection()
@@ -1,7 +1,29 @@
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from app.settings import settings
+from app.database import pool_stats as ps
 
-engine = create_engine(settings.sqlalchemy_connection_url)
-SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+engine = create_engine(
+    settings.sqlalchemy_connection_url,
+    poolclass=ps.MonitoredQueuePool,
+    **settings.sqlalchemy_pool_options,
+)
+ps.sync_pool_monitor.watch(engine.pool)
+
+# Objects must stay readable after commit without a refresh round trip, and
+# async sessions can't lazy load them at all
+SessionLocal = sessionmaker(
+    bind=engine, autocommit=False, autoflush=False, expire_on_commit=False
+)
+
+async_engine = create_async_engine(
+    settings.sqlalchemy_async_connection_url,
+    poolclass=ps.MonitoredAsyncQueuePool,
+    **settings.sqlalchemy_pool_options,
+)
+ps.async_pool_monitor.watch(async_engine.sync_engine.pool)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine, autoflush=False, expire_on_commit=False
+)
 Base = declarative_base()
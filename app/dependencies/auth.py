@@ -1,11 +1,11 @@
-from fastapi import Request, Depends
+from fastapi import Request, Depends, Path
 from typing import Annotated
 
 from app.crud.users import UserCrud
 from app.models import User
 from app.utils import auth as au
-from app.utils.database import dbSession
-from app.utils.error_utils import RaiseHttpException
+from app.utils.database import asyncDbSession
+from app.utils.error_utils import RaiseHttpException, ensure_positive_int
 
 token_types = str | None
 
@@ -91,18 +91,18 @@ def get_token_payload(token: Annotated[str, Depends(get_token)]):
 protect = Depends(get_token_payload)
 
 
-def get_user(db: dbSession, payload: Annotated[dict, protect]) -> User:
-    """Gets the user from the database using the access token payload
+async def get_user(db: asyncDbSession, payload: Annotated[dict, protect]) -> User:
+    """Gets the user from the user cache or the database using the token payload
 
     Args:
-        db (dbSession): The running db session
+        db (asyncDbSession): The running async db session
         payload (dict): The token payload from get_token_payload
 
 
     Returns:
         user (User): The user data from databse
     """
-    user = UserCrud.get_by_id(db, id=payload.get("my_id"))
+    user = await UserCrud.async_get_cached_by_id(db, id=payload.get("my_id"))
 
     if user is None:
         RaiseHttpException.unauthorized_with_headers(
@@ -112,7 +112,7 @@ def get_user(db: dbSession, payload: Annotated[dict, protect]) -> User:
     return user
 
 
-def get_active_user(user: Annotated[User, Depends(get_user)]):
+async def get_active_user(user: Annotated[User, Depends(get_user)]):
     """
     Returns an active user
     raise HttpException if user is Invalid
@@ -142,7 +142,7 @@ def restrict_to(*args):
     valid_roles = ["user", "staff", "admin"]
     assert all(i in valid_roles for i in args), "Invalid role arguments"
 
-    def handle_restrict_to(user: Annotated[User, current_active_user]):
+    async def handle_restrict_to(user: Annotated[User, current_active_user]):
         if user.role not in args:
             au.RaiseHttpException.forbidden(
                 "Access Denied!! You do not have permission"
@@ -151,3 +151,35 @@ def restrict_to(*args):
         return user
 
     return handle_restrict_to
+
+
+def restrict_to_owner(crud, not_found_msg: str, forbidden_msg: str):
+    """Restricts a /{id} route to the owner of the record, admins and staffs\n
+    Params:
+        crud (Crud): The crud of the record, its owner_id_stmt finds the owner
+        not_found_msg (str): Message when the record does not exist
+        forbidden_msg (str): Message when the user does not own the record
+    Returns:
+        user (User) : The permitted user's data from database
+    """
+
+    async def handle_restrict_to_owner(
+        db: asyncDbSession,
+        id: Annotated[int, Path()],
+        user: Annotated[User, current_active_user],
+    ):
+        if user.role in ("admin", "staff"):
+            return user
+
+        ensure_positive_int(num=id)
+        owner_id = await crud.async_get_owner_id(db, id)
+
+        if owner_id is None:
+            RaiseHttpException.not_found(not_found_msg)
+
+        if owner_id != user.id:
+            RaiseHttpException.forbidden(forbidden_msg)
+
+        return user
+
+    return handle_restrict_to_owner
@@ -3,12 +3,15 @@ from typing import Annotated
 from pydantic import EmailStr
 
 from app.schema.user import UserCreate, password_reg, e_164_phone_regex
-from app.utils.file_operations import store_image_file, ImageTooSmallException
+from app.settings import settings
+from app.utils.file_operations import store_image_file
+from app.utils.custom_exceptions import ImageTooSmallException, ImageTooLargeException
+from app.utils.custom_exceptions import ExecutorBusyError
 from app.utils.error_utils import RaiseHttpException
 from app.utils.general import title_case_words
 
 
-def handle_image_upload(profile_image: UploadFile = File(default=None)):
+async def handle_image_upload(profile_image: UploadFile = File(default=None)):
     image_name = None
     msg = None
 
@@ -24,10 +27,18 @@ def handle_image_upload(profile_image: UploadFile = File(default=None)):
         RaiseHttpException.bad_request(msg)
 
     try:
-        image_name = store_image_file(file=profile_image, location="users")
+        image_name = await store_image_file(file=profile_image)
     except ImageTooSmallException:
         msg = "The image file is too small. Image must be at least 180 X 180 pixels."
         RaiseHttpException.bad_request(msg)
+    except ImageTooLargeException:
+        max_mb = settings.image_max_upload_bytes // (1024 * 1024)
+        max_megapixels = settings.image_max_pixels // 1_000_000
+        msg = f"The image file is too large. Image must be at most {max_mb} MB"
+        RaiseHttpException.payload_too_large(f"{msg} and {max_megapixels} megapixels.")
+    except ExecutorBusyError:
+        msg = "We can't process your image right now. Try again later."
+        RaiseHttpException.service_unavailable(msg)
 
     return image_name
 
@@ -0,0 +1,179 @@
+"""
+Bulk import of creditors from a csv file through postgres COPY
+
+The csv is streamed into a temporary staging table with COPY FROM STDIN, then
+normalized and merged into creditors by a single INSERT ... ON CONFLICT DO NOTHING,
+so memory use doesn't grow with the size of the file.
+
+From the command line, RUN
+    python -m app.features.creditor_import creditors.csv --owner-id 1
+"""
+import csv
+import argparse
+from typing import BinaryIO
+from psycopg2 import DatabaseError
+
+from app.utils.custom_exceptions import ImportCsvError
+
+COPY_CHUNK_SIZE = 64 * 1024
+REQUIRED_COLUMNS = ("name", "city", "state", "phone")
+OPTIONAL_COLUMNS = (
+    "description",
+    "street_address",
+    "country",
+    "email",
+    "bank_name",
+    "account_number",
+)
+
+# The shape of address EmailStr accepts: a dot-atom local part and a domain of
+# dot separated labels
+EMAIL_PATTERN = (
+    r"^[a-z0-9!#$%&'*+/=?^_`{|}~-]+(\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+    r"@([a-z0-9]([a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}$"
+)
+STAGING_COLUMNS = ", ".join(f"{c} TEXT" for c in REQUIRED_COLUMNS + OPTIONAL_COLUMNS)
+CREATE_STAGING_TABLE = f"""
+    CREATE TEMP TABLE creditors_staging ({STAGING_COLUMNS}) ON COMMIT DROP;
+"""
+
+# initcap(btrim(...)) cases like initcap_words in CreditorCrud.process, so names
+# dedupe the same on both paths, and the valid CTE applies the MyCreditorCreate
+# field rules
+MERGE_STAGED_CREDITORS = """
+    WITH normalized AS (
+        SELECT
+            initcap(NULLIF(btrim(name), '')) AS name,
+            NULLIF(btrim(description), '') AS description,
+            NULLIF(btrim(street_address), '') AS street_address,
+            initcap(NULLIF(btrim(city), '')) AS city,
+            initcap(NULLIF(btrim(state), '')) AS state,
+            initcap(NULLIF(btrim(country), '')) AS country,
+            NULLIF(btrim(phone), '') AS phone,
+            lower(NULLIF(btrim(email), '')) AS email,
+            initcap(NULLIF(btrim(bank_name), '')) AS bank_name,
+            NULLIF(btrim(account_number), '') AS account_number
+        FROM creditors_staging
+    ),
+    valid AS (
+        SELECT * FROM normalized
+        WHERE name IS NOT NULL AND length(name) <= 100
+            AND city IS NOT NULL AND length(city) <= 40
+            AND state IS NOT NULL AND length(state) <= 40
+            AND phone ~ '^\\+[1-9]\\d{1,14}$'
+            AND (country IS NULL OR length(country) <= 40)
+            AND (description IS NULL OR length(description) <= 300)
+            AND (email IS NULL OR (
+                length(email) <= 70
+                AND length(split_part(email, '@', 1)) <= 64
+                AND email ~ %(email_pattern)s
+            ))
+            AND (bank_name IS NULL OR length(bank_name) <= 40)
+            AND (account_number IS NULL OR bank_name IS NOT NULL)
+    ),
+    inserted AS (
+        INSERT INTO creditors (
+            owner_id, name, description, street_address, city, state,
+            country, phone, email, bank_name, account_number
+        )
+        SELECT
+            %(owner_id)s, name, description, street_address, city, state,
+            country, phone, email, bank_name, account_number
+        FROM valid
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    )
+    SELECT
+        (SELECT count(*) FROM normalized) AS received,
+        (SELECT count(*) FROM valid) AS valid,
+        (SELECT count(*) FROM inserted) AS inserted;
+"""
+
+
+def read_csv_columns(csv_file: BinaryIO) -> list[str]:
+    """
+    Consumes the header line of the csv file and validates its column names
+
+    Raises:
+        ImportCsvError: If a column is unknown or a required column is missing
+    """
+    try:
+        header = csv_file.readline().decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise ImportCsvError("The csv file must be utf-8 encoded")
+
+    columns = [column.strip().lower() for column in next(csv.reader([header]), [])]
+
+    unknown = [c for c in columns if c not in REQUIRED_COLUMNS + OPTIONAL_COLUMNS]
+    if unknown:
+        raise ImportCsvError(f"Unknown csv columns: {', '.join(unknown)}")
+
+    missing = [c for c in REQUIRED_COLUMNS if c not in columns]
+    if missing:
+        raise ImportCsvError(f"Missing csv columns: {', '.join(missing)}")
+
+    if len(set(columns)) != len(columns):
+        raise ImportCsvError("The csv header has duplicate columns")
+
+    return columns
+
+
+def import_creditors_csv(conn, csv_file: BinaryIO, owner_id: int) -> dict:
+    """
+    Streams a creditors csv into the creditors table
+
+    The caller owns the transaction: commit to keep the imported creditors.
+
+    Args:
+        conn: A psycopg2 connection
+        csv_file (BinaryIO): The csv file opened in binary mode, header first
+        owner_id (int): The user recorded as the owner of the imported creditors
+
+    Returns:
+        dict: The received, inserted, skipped (invalid) and conflicting row counts
+    """
+    columns = read_csv_columns(csv_file)
+
+    try:
+        with conn.cursor() as cur:
+            cur.execute(CREATE_STAGING_TABLE)
+            cur.copy_expert(
+                f"COPY creditors_staging ({', '.join(columns)}) FROM STDIN CSV",
+                csv_file,
+                size=COPY_CHUNK_SIZE,
+            )
+            cur.execute(
+                MERGE_STAGED_CREDITORS,
+                {"owner_id": owner_id, "email_pattern": EMAIL_PATTERN},
+            )
+            received, valid, inserted = cur.fetchone()
+    except DatabaseError as e:
+        raise ImportCsvError(str(e).strip().splitlines()[0])
+
+    return {
+        "received": received,
+        "inserted": inserted,
+        "skipped": received - valid,
+        "conflicting": valid - inserted,
+    }
+
+
+if __name__ == "__main__":
+    from app.database.psycopg_config import get_connection
+
+    parser = argparse.ArgumentParser(description="Import creditors from a csv file")
+    parser.add_argument("csv_path", help="Path to the csv file, header row first")
+    parser.add_argument("--owner-id", type=int, required=True)
+    args = parser.parse_args()
+
+    connection = get_connection()
+    try:
+        with open(args.csv_path, mode="rb") as f:
+            report = import_creditors_csv(connection, f, owner_id=args.owner_id)
+        connection.commit()
+        print(report)
+    except ImportCsvError as e:
+        connection.rollback()
+        parser.exit(status=1, message=f"Import failed: {e}\n")
+    finally:
+        connection.close()
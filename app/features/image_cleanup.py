@@ -0,0 +1,75 @@
+"""
+Background task deleting the stored images no user refers to anymore
+
+Uploads never delete the image they replace: identical images are stored once and
+may be shared. Started with the app, this job walks the image storage in batches,
+asks which names are still some user's image_url and deletes the others. Images
+saved within the last IMAGE_CLEANUP_GRACE_SECS are left alone, they may belong to
+an upload whose user isn't committed yet.
+"""
+import time
+import asyncio
+import logging
+from itertools import islice
+from typing import Iterator
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.crud.users import UserCrud
+from app.database.sqlalchemy_config import AsyncSessionLocal
+from app.utils.file_operations import ImageStorage, image_storage, image_cache
+from app.utils.file_operations import source_image_name
+
+IMAGE_CLEANUP_INTERVAL_SECS = 3600
+IMAGE_CLEANUP_BATCH_SIZE = 1000
+IMAGE_CLEANUP_GRACE_SECS = 3600
+
+logger = logging.getLogger(__name__)
+
+
+def next_batch(image_names: Iterator[str]) -> list[str]:
+    return list(islice(image_names, IMAGE_CLEANUP_BATCH_SIZE))
+
+
+def delete_images(
+    storage: ImageStorage, image_names: list[str], saved_before: float
+) -> int:
+    deleted = 0
+    for image_name in image_names:
+        deleted += storage.delete(image_name, saved_before)
+        image_cache.pop(image_name)
+    return deleted
+
+
+async def purge_orphan_images(storage: ImageStorage = image_storage) -> int:
+    """Deletes every unreferenced image batch by batch, returns how many were"""
+    total = 0
+    saved_before = time.time() - IMAGE_CLEANUP_GRACE_SECS
+    image_names = storage.iter_names(saved_before)
+
+    async with AsyncSessionLocal() as db:
+        # The storage is walked on a threadpool thread, a batch at a time
+        while batch := await run_in_threadpool(next_batch, image_names):
+            # Variants live as long as the image they were made from
+            sources = {name: source_image_name(name) for name in batch}
+            in_use = await UserCrud.async_images_in_use(db, set(sources.values()))
+            orphans = [name for name in batch if sources[name] not in in_use]
+            # Images uploaded again while the batch was checked are kept
+            total += await run_in_threadpool(
+                delete_images, storage, orphans, saved_before
+            )
+            await db.rollback()  # Ends the read transaction between batches
+
+    return total
+
+
+async def sweep_orphan_images():
+    """Runs purge_orphan_images every IMAGE_CLEANUP_INTERVAL_SECS until cancelled"""
+    while True:
+        try:
+            deleted = await purge_orphan_images()
+            deleted and logger.info("Deleted %s orphan images", deleted)
+        except (SQLAlchemyError, OSError):
+            logger.exception("Deleting orphan images failed, retrying next sweep")
+
+        await asyncio.sleep(IMAGE_CLEANUP_INTERVAL_SECS)
@@ -0,0 +1,40 @@
+"""
+Background task purging expired one time passwords
+
+Started with the app, it deletes expired otps in small batches so a sweep never
+holds many row locks or blocks the otp issuing and verifying statements for long.
+"""
+import asyncio
+import logging
+from sqlalchemy.exc import SQLAlchemyError
+
+from app.crud.otps import OtpCrud
+from app.database.sqlalchemy_config import AsyncSessionLocal
+
+OTP_SWEEP_INTERVAL_SECS = 300
+OTP_SWEEP_BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+async def purge_expired_otps() -> int:
+    """Deletes every expired otp batch by batch and returns how many were deleted"""
+    total = 0
+
+    async with AsyncSessionLocal() as db:
+        while True:
+            deleted = await OtpCrud.async_purge_expired(db, OTP_SWEEP_BATCH_SIZE)
+            total += deleted
+            if deleted < OTP_SWEEP_BATCH_SIZE:
+                return total
+
+
+async def sweep_expired_otps():
+    """Runs purge_expired_otps every OTP_SWEEP_INTERVAL_SECS until cancelled"""
+    while True:
+        try:
+            await purge_expired_otps()
+        except (SQLAlchemyError, OSError):
+            logger.exception("Purging expired otps failed, retrying next sweep")
+
+        await asyncio.sleep(OTP_SWEEP_INTERVAL_SECS)
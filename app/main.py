@@ -1,14 +1,35 @@
 import os
+import asyncio
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from app.routers import api_v1
+from app.features.otp_sweeper import sweep_expired_otps
+from app.features.image_cleanup import sweep_orphan_images
+from app.settings import settings
+from app.utils.auth import password_executor
+from app.utils.file_operations import image_executor
+from app.utils.request_limits import MultipartSizeLimitMiddleware
 from fastapi.middleware.cors import CORSMiddleware
 
+# The routes taking a profile image, the only multipart bodies capped up front
+IMAGE_UPLOAD_PATHS = [
+    ("POST", "/api/v1/auth/signup"),
+    ("POST", "/api/v1/users/"),
+    ("PATCH", "/api/v1/me/profile-picture"),
+]
 
 app = FastAPI(
     title="My Expense tracker application",
     version="1.0",
+    default_response_class=ORJSONResponse,
 )
 
+# Added first so the CORS middleware wraps its 413 responses
+app.add_middleware(
+    MultipartSizeLimitMiddleware,
+    max_bytes=settings.multipart_max_body_bytes,
+    paths=IMAGE_UPLOAD_PATHS,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -20,6 +41,36 @@ app.add_middleware(
 app.include_router(api_v1.router)
 
 
+@app.on_event("startup")
+async def start_otp_sweeper():
+    app.state.otp_sweeper = asyncio.create_task(sweep_expired_otps())
+
+
+@app.on_event("shutdown")
+async def stop_otp_sweeper():
+    app.state.otp_sweeper.cancel()
+
+
+@app.on_event("startup")
+async def start_image_cleanup():
+    app.state.image_cleanup = asyncio.create_task(sweep_orphan_images())
+
+
+@app.on_event("shutdown")
+async def stop_image_cleanup():
+    app.state.image_cleanup.cancel()
+
+
+@app.on_event("shutdown")
+def stop_password_executor():
+    password_executor.shutdown()
+
+
+@app.on_event("shutdown")
+def stop_image_executor():
+    image_executor.shutdown()
+
+
 """
 Alternatively, RUN uvicorn app.main:app from CLI to start server at port 8000
 For Debugging, RUN uvicorn app.main:app --reload from CLI
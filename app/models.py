@@ -2,7 +2,6 @@ import sqlalchemy as sa
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.expression import text, func
 
-from app.utils import auth as au
 from app.database.sqlalchemy_config import Base
 
 
@@ -18,6 +17,11 @@ class User(Base):
             """,
             name="users_password_email_ck",
         ),
+        sa.Index(
+            "users_image_url_idx",
+            "image_url",
+            postgresql_where=text("image_url IS NOT NULL"),
+        ),
     )
 
     id = sa.Column(sa.Integer, primary_key=True)
@@ -27,10 +31,6 @@ class User(Base):
     phone = sa.Column(sa.String(25), unique=True, nullable=False)
     email = sa.Column(sa.String(30), unique=True)
     verified = sa.Column(sa.Boolean(), server_default=text("False"))
-    otp = sa.Column(sa.String)
-    otp_expires_at = sa.Column(
-        sa.DateTime(timezone=True),
-    )
     role = sa.Column(sa.Enum("user", "staff", "admin", name="users_role_enum"))
     password = sa.Column(sa.LargeBinary)
     image_url = sa.Column(sa.String)
@@ -47,9 +47,6 @@ class User(Base):
 
     user_bills = relationship("Bill", back_populates="user_owner")
 
-    def compare_password(self, password) -> bool:
-        return au.authenticate_password(password, self.password)
-
 
 class Creditor(Base):
     __tablename__ = "creditors"
@@ -63,6 +60,7 @@ class Creditor(Base):
             "account_number IS NULL OR bank_name IS NOT NULL",
             name="creditors_account_number_bank_ck",
         ),
+        sa.Index("creditors_owner_id_id_idx", "owner_id", "id"),
     )
 
     id = sa.Column(sa.Integer, primary_key=True)
@@ -94,6 +92,7 @@ class Bill(Base):
         sa.UniqueConstraint(
             "user_id", "creditor_id", name="bills_user_id_creditor_id_key"
         ),
+        sa.Index("bills_user_id_id_idx", "user_id", "id"),
     )
 
     id = sa.Column(sa.Integer, primary_key=True)
@@ -125,6 +124,7 @@ class Bill(Base):
 
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (sa.Index("payments_bill_id_id_idx", "bill_id", "id"),)
 
     id = sa.Column(sa.Integer, primary_key=True)
     bill_id = sa.Column(
@@ -140,3 +140,39 @@ class Payment(Base):
     created_at = sa.Column(sa.DateTime(timezone=True), server_default=func.now())
 
     owner_bill = relationship("Bill", back_populates="payments")
+
+
+class UserBalanceSummary(Base):
+    """Kept up to date by triggers on bills and payments, never written by the app"""
+
+    __tablename__ = "user_balance_summary"
+
+    user_id = sa.Column(
+        sa.Integer, sa.ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    total_credit = sa.Column(sa.Numeric(14, 2), server_default=text("0.00"))
+    total_paid = sa.Column(sa.Numeric(14, 2), server_default=text("0.00"))
+    outstanding = sa.Column(sa.Numeric(14, 2), server_default=text("0.00"))
+    open_bill_count = sa.Column(sa.Integer, server_default=text("0"))
+    last_payment_at = sa.Column(sa.DateTime(timezone=True))
+    updated_at = sa.Column(sa.DateTime(timezone=True), server_default=func.now())
+    # Bumped when a bill is deleted, which changes the user's past analytics
+    analytics_version = sa.Column(sa.Integer, server_default=text("0"), nullable=False)
+
+
+class Otp(Base):
+    __tablename__ = "otps"
+    __table_args__ = (sa.Index("otps_expires_at_idx", "expires_at"),)
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    user_id = sa.Column(
+        sa.Integer, sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    purpose = sa.Column(
+        sa.Enum("login", "update_credentials", name="otps_purpose_enum"),
+        nullable=False,
+    )
+    # HMAC of the purpose and the code, the code itself is never stored
+    code_hash = sa.Column(sa.String(64), nullable=False, unique=True)
+    expires_at = sa.Column(sa.DateTime(timezone=True), nullable=False)
+    created_at = sa.Column(sa.DateTime(timezone=True), server_default=func.now())
@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from app.routers import users, bills, creditors, payments, auth, me
+from app.routers import users, bills, creditors, payments, auth, me, internal
 
 router = APIRouter(prefix="/api/v1")
 
@@ -10,3 +10,4 @@ router.include_router(bills.router)
 router.include_router(creditors.router)
 router.include_router(payments.router)
 router.include_router(auth.router)
+router.include_router(internal.router)
@@ -3,9 +3,11 @@ import asyncio
 from sqlalchemy.exc import IntegrityError
 from pydantic import EmailStr
 from fastapi import APIRouter, Response, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
 
 from app.routers import login
 from app.crud.users import UserCrud
+from app.crud.otps import OtpCrud
 from app.schema import user as u
 from app.schema.response import DefaultResponse
 from app.features.sms import SMSMessenger, SendSmsError
@@ -15,9 +17,9 @@ from app.dependencies.auth import current_active_user
 from app.dependencies import user_multipart as um
 from app.utils import auth as au
 from app.utils import error_utils as eu
-from app.utils.database import dbSession
+from app.utils.database import dbSession, asyncDbSession
 from app.utils import error_messages as em
-from app.utils.general import add_minutes, get_user_full_name, to_bool_to_int
+from app.utils.general import get_user_full_name, to_bool_to_int
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 router.include_router(login.router)
@@ -35,16 +37,17 @@ async def sign_up_user(
 
     # Only the admin or staff can create a user with a different role.
     user.role = "user"
-    user_data = user.__dict__
-    user_otp = au.generate_otp(5)
-    update_data = au.set_otp_columns_data(user_otp, add_minutes(minutes=10))
-    user_data.update(update_data)
 
     try:
-        db_user = UserCrud.create(db=db, user=u.UserSignUp(**user_data))
+        # Hashing the password and the sync session block, keep them off the loop
+        db_user = await run_in_threadpool(UserCrud.create, db=db, user=user)
     except IntegrityError as e:
         eu.handle_users_integrity_exception(str(e))
 
+    user_otp = await run_in_threadpool(
+        OtpCrud.issue, db, db_user.id, purpose="login", minutes=10
+    )
+
     user_full_name = get_user_full_name(db_user)
     email_success = True
     sms_success = True
@@ -72,7 +75,7 @@ async def sign_up_user(
 
 @router.get("/access-code", response_model=DefaultResponse)
 async def get_access_code(
-    db: dbSession,
+    db: asyncDbSession,
     request: Request,
     phone: str = Query(default=None),
     email: EmailStr = Query(default=None),
@@ -97,16 +100,16 @@ async def get_access_code(
         if not au.validate_phone_number(phone=phone_number):
             eu.RaiseHttpException.bad_request("Provide a valid phone number")
 
-        db_user = UserCrud.get_by_phone(db, phone=phone_number)
+        db_user = await UserCrud.async_get_by_phone(db, phone=phone_number)
     else:
-        db_user = UserCrud.get_by_email(db, email)
+        db_user = await UserCrud.async_get_by_email(db, email)
 
     if db_user is None:
         eu.RaiseHttpException.not_found("The user does not exist in our records")
 
-    otp = au.generate_otp(5)
-    to_update = au.set_otp_columns_data(otp, add_minutes())
-    UserCrud.update_user_by_phone(db, db_user.phone, to_update)
+    update_email = request.headers.get("Update-Email") == "YES"
+    purpose = "update_credentials" if update_email else "login"
+    otp = await OtpCrud.async_issue(db, db_user.id, purpose=purpose)
     user_full_name = get_user_full_name(db_user)
     receiver = None
 
@@ -121,7 +124,7 @@ async def get_access_code(
     else:
         try:
             email_handler = EmailMessenger(db_user.email, user_full_name)
-            if request.headers.get("Update-Email") == "YES":
+            if update_email:
                 await email_handler.send_update_email_otp(otp)
             else:
                 await email_handler.send_login(otp)
@@ -135,12 +138,11 @@ async def get_access_code(
     )
 
 
-@router.patch(
-    "/credentials", response_model=DefaultResponse, dependencies=[current_active_user]
-)
+@router.patch("/credentials", response_model=DefaultResponse)
 def update_phone_email(
     db: dbSession,
     request: Request,
+    me: Annotated[u.UserAllInfo, current_active_user],
     phone: str = Query(default=None, regex=u.e_164_phone_regex),
     email: EmailStr = Query(default=None),
 ):
@@ -154,17 +156,23 @@ def update_phone_email(
         msg = "Provide either a phone number or an email address to be updated"
         eu.RaiseHttpException.bad_request(msg)
 
-    user = au.handle_get_user_by_otp(db, otp=request.headers.get("Access-Code"))
-    au.check_otp_expired(user.otp_expires_at)
+    # Codes sent to a phone have always been usable here too, hence "login". Only
+    # the logged-in user's own codes are looked up and consumed
+    au.handle_consume_user_otp(
+        db,
+        otp=request.headers.get("Access-Code"),
+        purposes=["update_credentials", "login"],
+        user_id=me.id,
+    )
 
     # Ensure credentials to be updated are not the same as already in database
     # No need to query the db when we don't have to
     credentials_to_update = {}
-    if phone and (user.phone == phone):
+    if phone and (me.phone == phone):
         msg = "The phone number is the user's current phone number"
         eu.RaiseHttpException.bad_request(msg)
 
-    elif email and (user.email == email):
+    elif email and (me.email == email):
         msg = "The email address is the user's current email address"
         eu.RaiseHttpException.bad_request(msg)
 
@@ -173,12 +181,8 @@ def update_phone_email(
         email and credentials_to_update.update({"email": email})
 
     to_update = au.handle_credentials_to_update_config(credentials_to_update)
-    try:
-        UserCrud.update_user_by_phone(db, user.phone, to_update)
-    except IntegrityError as e:
-        eu.handle_users_integrity_exception(str(e))
-    else:
-        return DefaultResponse(message=au.update_credentials_response_msg(phone, email))
+    UserCrud.update_by_id(db, me.id, to_update, "user")
+    return DefaultResponse(message=au.update_credentials_response_msg(phone, email))
 
 
 @router.get(
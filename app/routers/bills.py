@@ -1,20 +1,27 @@
-from fastapi import APIRouter, Body, Query, Path, Depends
+from fastapi import APIRouter, Body, Path, Depends
 from typing import Annotated
+from sqlalchemy.orm import selectinload
 
-
+from app.models import Bill
 from app.crud.bills import BillCrud
 from app.dependencies import auth
 
 from app.schema import bill_payment as bp
 from app.schema.response import DefaultResponse
-from app.utils.database import dbSession
+from app.utils.database import asyncDbSession
+from app.utils.pagination import pageParams
+from app.utils.streaming import streamRequested, ndjson_response
 from app.utils import error_utils as eu, bills as b
+from app.utils.responses import trusted_response
 
 
 class BillWithPayments(bp.BillOut):
     payments: list[bp.PaymentOut] = []
 
 
+bill_with_payments_options = [selectinload(Bill.payments)]
+
+
 router = APIRouter(
     prefix="/bills", tags=["bills"], dependencies=[auth.current_active_user]
 )
@@ -28,48 +35,56 @@ allow_admin_staff = [Depends(auth.restrict_to("staff", "admin"))]
     status_code=201,
     dependencies=allow_admin_staff,
 )
-def create_bill(db: dbSession, bill_data: Annotated[bp.BillCreate, Body()]):
-    return b.handle_make_bill(db, bill=bill_data.__dict__)
-
-
-@router.get("/", response_model=list[bp.BillOut], dependencies=allow_admin_staff)
-def get_bills(
-    db: dbSession,
-    skip: int = Query(default=0),
-    limit: int = Query(default=100),
-):
-    bills = BillCrud.get_records(db, skip, limit)
-    return eu.handle_records(records=bills, table_name="bills")
+async def create_bill(db: asyncDbSession, bill_data: Annotated[bp.BillCreate, Body()]):
+    return await b.handle_make_bill(db, bill=bill_data.__dict__)
+
+
+@router.get("/", response_model=bp.GetBills, dependencies=allow_admin_staff)
+async def get_bills(db: asyncDbSession, page: pageParams, stream: streamRequested):
+    """Send the header Accept: application/x-ndjson to stream every bill"""
+    if stream:
+        batches = BillCrud.async_stream_records(db, after_id=page.after_id)
+        return ndjson_response(batches, schema=bp.BillOut)
+
+    bills, next_cursor = await BillCrud.async_get_records(db, page)
+    return trusted_response(
+        bp.GetBills(
+            data=eu.handle_records(records=bills, table_name="bills"),
+            next_cursor=next_cursor,
+        )
+    )
+
+
+bill_owner_only = auth.restrict_to_owner(
+    BillCrud,
+    not_found_msg="The bill does not exist",
+    forbidden_msg="You can't get a bill you didn't create",
+)
 
 
-@router.get("/{id}", response_model=BillWithPayments)
-def get_bill(
-    db: dbSession, id: Annotated[int, Path()], user: auth.active_user_annontated
-):
+@router.get(
+    "/{id}", response_model=BillWithPayments, dependencies=[Depends(bill_owner_only)]
+)
+async def get_bill(db: asyncDbSession, id: Annotated[int, Path()]):
     eu.ensure_positive_int(num=id)
-    bill = BillCrud.get_by_id(db=db, id=id)
+    bill = await BillCrud.async_get_by_id(
+        db=db, id=id, options=bill_with_payments_options
+    )
 
     if bill is None:
         eu.RaiseHttpException.not_found("The bill does not exist")
 
-    if user.role not in ("admin", "staff"):
-        bills = BillCrud.get_bills_for_user(db, user_id=user.id)
-
-        # Error out if the user didn't make the bill
-        if not any(b for b in bills if b.id == bill.id):
-            eu.RaiseHttpException.forbidden("You can't get a bill you didn't create")
-
     return bill
 
 
 @router.delete(
     "/{id}", status_code=204, dependencies=[Depends(auth.restrict_to("admin"))]
 )
-def delete_bill(
-    db: dbSession,
+async def delete_bill(
+    db: asyncDbSession,
     id: Annotated[int, Path()],
 ):
     eu.ensure_positive_int(num=id)
 
-    BillCrud.delete_by_id(db=db, id=id)
+    await BillCrud.async_delete_by_id(db=db, id=id)
     return ""
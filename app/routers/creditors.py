@@ -1,6 +1,6 @@
 from typing import Annotated
 from sqlalchemy.exc import IntegrityError
-from fastapi import APIRouter, Body, Path, Query, Depends
+from fastapi import APIRouter, Body, Path, Query, Depends, UploadFile
 
 from app.dependencies import auth
 from app.crud.creditors import CreditorCrud
@@ -8,8 +8,12 @@ from app.crud.creditors import CreditorCrud
 from app.schema.response import DefaultResponse
 from app.schema import creditor as cr
 from app.utils import error_utils as eu
-from app.utils.database import dbSession
-from app.utils.custom_exceptions import DataError
+from app.utils.database import asyncDbSession, dbSession
+from app.utils.pagination import pageParams
+from app.utils.streaming import streamRequested, ndjson_response
+from app.utils.custom_exceptions import DataError, ImportCsvError
+from app.utils.responses import trusted_response
+from app.features.creditor_import import import_creditors_csv
 
 router = APIRouter(
     prefix="/creditors",
@@ -19,10 +23,13 @@ router = APIRouter(
 
 
 @router.post("/", response_model=DefaultResponse, status_code=201)
-def create_creditor(db: dbSession, creditor: Annotated[cr.CreditorCreate, Body()]):
+async def create_creditor(
+    db: asyncDbSession, creditor: Annotated[cr.CreditorCreate, Body()]
+):
     try:
-        creditor = CreditorCrud.create(db, creditor)
+        creditor = await CreditorCrud.async_create(db, creditor)
     except IntegrityError as e:
+        await db.rollback()
         eu.handle_creditors_integrity_exception(str(e))
     else:
         return DefaultResponse(
@@ -30,24 +37,59 @@ def create_creditor(db: dbSession, creditor: Annotated[cr.CreditorCreate, Body()
         )
 
 
-@router.get("/", response_model=DefaultResponse)
-def get_creditors(db: dbSession, skip: int = 0, limit: int = 100):
-    creditors = CreditorCrud.get_records(db, skip=skip, limit=limit)
-    return DefaultResponse(
-        data=eu.handle_records(records=creditors, table_name="creditors")
+@router.post(
+    "/import",
+    response_model=DefaultResponse,
+    status_code=201,
+    dependencies=[Depends(auth.restrict_to("admin"))],
+)
+def import_creditors(
+    db: dbSession, file: UploadFile, user: auth.active_user_annontated
+):
+    """Bulk imports creditors from a csv file owned by the current admin
+
+    - **file**: csv with a header row. name, city, state and phone are required,
+    description, street_address, country, email, bank_name and account_number are
+    optional. Rows that are invalid or clash with an existing creditor are skipped.
+    """
+    try:
+        conn = db.connection().connection
+        report = import_creditors_csv(conn, file.file, owner_id=user.id)
+    except ImportCsvError as e:
+        eu.RaiseHttpException.bad_request(str(e))
+    else:
+        db.commit()
+        return DefaultResponse(
+            data=report, message=f"Imported {report['inserted']} creditors"
+        )
+
+
+@router.get("/", response_model=cr.GetCreditors)
+async def get_creditors(db: asyncDbSession, page: pageParams, stream: streamRequested):
+    """Send the header Accept: application/x-ndjson to stream every creditor"""
+    if stream:
+        batches = CreditorCrud.async_stream_records(db, after_id=page.after_id)
+        return ndjson_response(batches, schema=cr.CreditorOut)
+
+    creditors, next_cursor = await CreditorCrud.async_get_records(db, page=page)
+    return trusted_response(
+        cr.GetCreditors(
+            data=eu.handle_records(records=creditors, table_name="creditors"),
+            next_cursor=next_cursor,
+        )
     )
 
 
 @router.get("/{id}", response_model=DefaultResponse)
-def get_creditor(
-    db: dbSession,
+async def get_creditor(
+    db: asyncDbSession,
     id: Annotated[int, Path()],
     name: str = Query(default=None),
     phone: str = Query(default=None),
     email: str = Query(default=None),
 ):
     if id > 0:
-        creditor = CreditorCrud.get_by_id(db, id=id)
+        creditor = await CreditorCrud.async_get_by_id(db, id=id)
     else:
         if not any([phone, name, email]):
             eu.RaiseHttpException.bad_request(
@@ -55,11 +97,11 @@ def get_creditor(
             )
 
         if phone:
-            creditor = CreditorCrud.get_by_phone(db, phone)
+            creditor = await CreditorCrud.async_get_by_phone(db, phone)
         elif name:
-            creditor = CreditorCrud.get_creditor_by_name(db, name)
+            creditor = await CreditorCrud.async_get_creditor_by_name(db, name)
         else:  # email address
-            creditor = CreditorCrud.get_by_email(db, email)
+            creditor = await CreditorCrud.async_get_by_email(db, email)
 
     if creditor is None:
         eu.RaiseHttpException.not_found("The creditor does not exist")
@@ -68,8 +110,8 @@ def get_creditor(
 
 
 @router.patch("/{id}", response_model=DefaultResponse)
-def update_creditor(
-    db: dbSession,
+async def update_creditor(
+    db: asyncDbSession,
     id: Annotated[int, Path()],
     creditor_data: Annotated[cr.CreditorUpdate, Body()],
 ):
@@ -78,7 +120,7 @@ def update_creditor(
     except DataError as e:
         eu.RaiseHttpException.bad_request(str(e))
     else:
-        updated = CreditorCrud.update_by_id(db, id, data, table="creditors")
+        updated = await CreditorCrud.async_update_by_id(db, id, data, table="creditors")
         return DefaultResponse(data=updated)
 
 
@@ -87,6 +129,6 @@ def update_creditor(
     status_code=204,
     dependencies=[Depends(auth.restrict_to("staff", "admin"))],
 )
-def delete_creditor(db: dbSession, id: Annotated[int, Path()]):
-    CreditorCrud.delete_by_id(db=db, id=id, table="creditor")
+async def delete_creditor(db: asyncDbSession, id: Annotated[int, Path()]):
+    await CreditorCrud.async_delete_by_id(db=db, id=id, table="creditor")
     return ""
@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Depends
+
+from app.dependencies import auth
+from app.crud.users import user_cache
+from app.utils.auth import token_cache, password_executor
+from app.utils.file_operations import image_executor, image_cache
+from app.database import pool_stats as ps
+from app.database.sqlalchemy_config import engine, async_engine
+from app.schema.response import DefaultResponse
+
+router = APIRouter(
+    prefix="/internal",
+    tags=["internal"],
+    dependencies=[Depends(auth.restrict_to("admin"))],
+)
+
+
+@router.get("/pool", response_model=DefaultResponse)
+async def get_pool_stats():
+    """Returns the live connection pool statistics of this worker"""
+    return DefaultResponse(
+        data={
+            "sync": ps.sync_pool_monitor.snapshot(engine.pool),
+            "async": ps.async_pool_monitor.snapshot(async_engine.sync_engine.pool),
+        }
+    )
+
+
+@router.get("/cache", response_model=DefaultResponse)
+async def get_cache_stats():
+    """Returns the hit and miss counters of this worker's caches"""
+    return DefaultResponse(
+        data={
+            "users": user_cache.stats(),
+            "tokens": token_cache.stats(),
+            "images": image_cache.stats(),
+        }
+    )
+
+
+@router.get("/executors", response_model=DefaultResponse)
+async def get_executor_stats():
+    """Returns the queue and latency statistics of this worker's cpu executors"""
+    return DefaultResponse(
+        data={
+            "password": password_executor.stats(),
+            "image": image_executor.stats(),
+        }
+    )
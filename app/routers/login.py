@@ -37,6 +37,10 @@ def login_with_email_password(
     if not is_authenticated:
         au.RaiseHttpException.unauthorized_with_headers(invalidCred.invalid_password)
 
+    # Upgrade hashes made with an outdated cost while the plain password is at hand
+    if au.password_needs_rehash(user.password):
+        UserCrud.update_user_password(db, user.id, new_password=user_data.password)
+
     access_token = au.handle_create_token_for_user(user_data=user)
     au.set_cookie_header_response(response=response, token=access_token)
     return au.get_auth_success_response(
@@ -56,11 +60,7 @@ def login_with_access_code(
 
     Returns the user data and access token
     """
-    user = au.handle_get_user_by_otp(db, otp=code)
-    au.check_otp_expired(user.otp_expires_at)
-
-    to_update = au.set_otp_columns_data(verified=True)
-    UserCrud.update_user_by_phone(db, user.phone, to_update)
+    user = au.handle_verify_user_by_otp(db, otp=code)
     access_token = au.handle_create_token_for_user(user)
 
     au.set_cookie_header_response(response=response, token=access_token)
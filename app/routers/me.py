@@ -1,9 +1,10 @@
-import os
-from typing import Annotated
-from fastapi.responses import FileResponse
+from datetime import datetime
+from typing import Annotated, Literal
 from sqlalchemy.exc import IntegrityError
-from fastapi import APIRouter, Body, Path, Depends
+from sqlalchemy.orm import selectinload
+from fastapi import APIRouter, Body, Path, Depends, Query, Request
 
+from app.models import User
 from app.crud.users import UserCrud
 from app.crud.bills import BillCrud
 from app.crud.payments import PaymentCrud, CreatePaymentException
@@ -15,10 +16,15 @@ from app.dependencies.auth import current_active_user
 from app.dependencies.user_multipart import handle_image_upload
 
 from app.utils import error_utils as eu
-from app.utils.database import dbSession
+from app.utils import auth as au
+from app.utils.database import asyncDbSession, dbSession
+from app.utils.pagination import pageParams
 from app.utils.bills import handle_make_bill
-from app.utils.file_operations import absolute_path_for_image
+from app.utils.time_buckets import to_naive_utc
 from app.utils.custom_exceptions import DataError, QueryExecError
+from app.utils.responses import trusted_response, image_response
+from app.utils.responses import IMMUTABLE_CACHE_CONTROL, REVALIDATE_CACHE_CONTROL
+from app.utils.streaming import streamRequested, ndjson_response
 
 
 router = APIRouter(prefix="/me", tags=["me"], dependencies=[current_active_user])
@@ -26,60 +32,82 @@ current_user = Annotated[u.UserAllInfo, current_active_user]
 
 
 @router.get("/", response_model=u.UserOutWithBills)
-def get_me(me: current_user):
+async def get_me(db: asyncDbSession, me: current_user):
     """Returns the data of the currently logged-in active user"""
-    return me
+    return await UserCrud.async_get_by_id(
+        db, me.id, options=[selectinload(User.user_bills)]
+    )
 
 
 @router.get('/profile-picture')
-async def get_my_profile_image(me: current_user):
+async def get_my_profile_image(
+    request: Request, me: current_user, size: int = Query(default=None, ge=1, le=2000)
+):
+    """
+    Always your current image, so clients revalidate it with If-None-Match.
+    Prefer /profile-picture/{image_url}, which can be cached for good
+    - **size**: Get the variant nearest to size pixels instead, as webp or jpeg
+    depending on the Accept header
+    """
     if me.image_url is None:
         eu.raise_400_exception("There is no image associated with this user")
 
-    image_file = absolute_path_for_image(me.image_url)
-
-    if not os.path.exists(image_file):
+    try:
+        return await image_response(
+            request, me.image_url, REVALIDATE_CACHE_CONTROL, size=size
+        )
+    except FileNotFoundError:
         eu.RaiseHttpException.server_error('The image weirdly doesn\'t exist')
 
-    return FileResponse(image_file)
+
+@router.get("/profile-picture/{image_name}")
+async def get_my_profile_image_version(
+    request: Request,
+    me: current_user,
+    image_name: Annotated[str, Path()],
+    size: int = Query(default=None, ge=1, le=2000),
+):
+    """Serves your image by name. Names are content addressed, so it never changes"""
+    if me.image_url is None or image_name != me.image_url:
+        eu.RaiseHttpException.not_found("This is not your current profile image")
+
+    try:
+        return await image_response(
+            request, image_name, IMMUTABLE_CACHE_CONTROL, size=size
+        )
+    except FileNotFoundError:
+        eu.RaiseHttpException.server_error("The image weirdly doesn't exist")
 
 
 # ------------ MY UPDATE OPERATIONS ---
 
 
 @router.patch("/", response_model=u.UserOut)
-def update_me(db: dbSession, me: current_user, data: Annotated[u.UpdateMe, Body()]):
+async def update_me(
+    db: asyncDbSession, me: current_user, data: Annotated[u.UpdateMe, Body()]
+):
     try:
         user_data = data.ensure_valid_field()
     except DataError as e:
         eu.raise_400_exception(str(e))
     else:
-        return UserCrud.update_user_by_phone(db, me.phone, user_data)
+        return await UserCrud.async_update_user_by_phone(db, me.phone, user_data)
 
 
 @router.patch('/profile-picture', response_model=r.DefaultResponse)
-def upload_profile_image(
-    db: dbSession,
+async def upload_profile_image(
+    db: asyncDbSession,
     me: current_user,
     image_url: Annotated[str, Depends(handle_image_upload)],
 ):
     if image_url is None:
         eu.raise_400_exception('Provide an image file!')
 
-    prev_image_url = me.image_url
-    updated_me = UserCrud.update_by_id(
+    # The previous image is deleted by the image cleanup job once no one uses it
+    updated_me = await UserCrud.async_update_by_id(
         db=db, id=me.id, data={"image_url": image_url}, table='users'
     )
 
-    # Delete the previous image if exists
-    if prev_image_url:
-        prev_image_loc = absolute_path_for_image(prev_image_url)
-        if os.path.exists(prev_image_loc):
-            try:
-                os.remove(prev_image_loc)
-            except OSError:
-                pass
-
     return r.DefaultResponse(
         data={"image_url": updated_me.image_url},
         message='Profile image is updated successfully!',
@@ -89,8 +117,8 @@ def upload_profile_image(
 @router.patch(
     "/password", response_model=r.DefaultResponse, dependencies=[current_active_user]
 )
-def update_my_password(
-    db: dbSession,
+async def update_my_password(
+    db: asyncDbSession,
     credentials: Annotated[u.UserUpdatePassword, Body()],
     me: current_user,
 ):
@@ -104,18 +132,20 @@ def update_my_password(
         eu.raise_400_exception("User does not have an email and password credentils")
 
     # Ensure the password is the user's password
-    if not me.compare_password(password=credentials.password):
+    if not await au.async_authenticate_password(credentials.password, me.password):
         eu.RaiseHttpException.unauthorized_with_headers("Invalid password")
 
     if credentials.new_password != credentials.new_password_confirm:
         eu.raise_400_exception("The passwords do not match")
 
     # Ensure the new password is not the same as the old one
-    if me.compare_password(password=credentials.new_password):
+    if await au.async_authenticate_password(credentials.new_password, me.password):
         eu.raise_400_exception("The new password is the same as the old one")
 
     # Update the user's password
-    UserCrud.update_user_password(db, me.id, new_password=credentials.new_password)
+    await UserCrud.async_update_user_password(
+        db, me.id, new_password=credentials.new_password
+    )
     return r.DefaultResponse(message="Password updated successfully")
 
 
@@ -123,24 +153,34 @@ def update_my_password(
 
 
 @router.delete("/", status_code=204)
-def delete_me(db: dbSession, me: current_user):
+async def delete_me(db: asyncDbSession, me: current_user):
     """Deletes the currently logged-in user from the database"""
-    UserCrud.delete_me(db=db, id=me.id)
+    await UserCrud.async_delete_me(db=db, id=me.id)
     return ""
 
 
 # ----------------------------------- MY CREDITORS ---------------------------
 
 
-@router.get("/creditors", response_model=r.DefaultResponse)
-def get_my_creditors(me: current_user):
+@router.get("/creditors", response_model=c.GetMyCreditors)
+def get_my_creditors(
+    db: dbSession, me: current_user, page: pageParams, stream: streamRequested
+):
+    """Send the header Accept: application/x-ndjson to stream all your creditors"""
+    if stream:
+        batches = CreditorCrud.stream_creditors_for_user(db, me.id, page.after_id)
+        return ndjson_response(batches, schema=c.MyCreditorOut)
+
     try:
-        creditors = CreditorCrud.get_creditors_for_user(me.id)
+        creditors, next_cursor = CreditorCrud.get_creditors_for_user(db, me.id, page)
     except QueryExecError:
         eu.RaiseHttpException.server_error("Error fetching your creditors.")
     else:
-        return r.DefaultResponse(
-            data=eu.handle_records(records=creditors, table_name="creditors")
+        return trusted_response(
+            c.GetMyCreditors(
+                data=eu.handle_records(records=creditors, table_name="creditors"),
+                next_cursor=next_cursor,
+            )
         )
 
 
@@ -153,8 +193,8 @@ class MyCreditorBillCreate(c.MyCreditorCreate):
 
 
 @router.post("/bills", response_model=r.DefaultResponse)
-def create_my_bill(
-    db: dbSession,
+async def create_my_bill(
+    db: asyncDbSession,
     me: current_user,
     bill_data: Annotated[bp.MyBillCreate | MyCreditorBillCreate, Body()],
 ):
@@ -165,8 +205,11 @@ def create_my_bill(
         creditor.pop("total_credit_amount") and creditor.pop("total_paid_amount")
 
         try:
-            db_creditor = CreditorCrud.create(db, c.CreditorCreate(**creditor))
+            db_creditor = await CreditorCrud.async_create(
+                db, c.CreditorCreate(**creditor)
+            )
         except IntegrityError as e:
+            await db.rollback()
             eu.handle_creditors_integrity_exception(str(e))
         else:
             bill = {
@@ -180,66 +223,108 @@ def create_my_bill(
         bill = bill_data.__dict__
         bill["user_id"] = me.id
 
-    return handle_make_bill(db, bill)
+    return await handle_make_bill(db, bill)
 
 
-@router.get("/bills", response_model=r.DefaultResponse)
-def get_my_bills(db: dbSession, me: current_user):
-    my_bills = BillCrud.get_bills_for_user(db, user_id=me.id)
-    return r.DefaultResponse(
-        data=eu.handle_records(records=my_bills, table_name="bills")
+@router.get("/summary", response_model=bp.GetBalanceSummary)
+async def get_my_summary(db: asyncDbSession, me: current_user):
+    """Returns the totals over all of the user's bills, kept current on every write"""
+    summary = await BillCrud.async_get_balance_summary(db, user_id=me.id)
+    data = bp.BalanceSummaryOut.from_orm(summary) if summary else bp.BalanceSummaryOut()
+    return bp.GetBalanceSummary(data=data)
+
+
+@router.get("/bills", response_model=bp.GetBills)
+async def get_my_bills(db: asyncDbSession, me: current_user, page: pageParams):
+    my_bills, next_cursor = await BillCrud.async_get_bills_page_for_user(
+        db, user_id=me.id, page=page
+    )
+    return trusted_response(
+        bp.GetBills(
+            data=eu.handle_records(records=my_bills, table_name="bills"),
+            next_cursor=next_cursor,
+        )
     )
 
 
 @router.delete("/bills/{id}", status_code=204)
-def delete_my_bill(
-    db: dbSession,
+async def delete_my_bill(
+    db: asyncDbSession,
     id: Annotated[int, Path(description="The id of the bill to be deleted")],
     me: current_user,
 ):
     eu.ensure_positive_int(num=id)
-    bill: bp.BillOutAllInfo = BillCrud.get_by_id(db, id)
-
-    if bill.user_id != me.id:
-        eu.RaiseHttpException.forbidden("You can only delete your bills")
-
-    BillCrud.delete_by_id(db, id)
+    await BillCrud.async_delete_by_id(db, id, user_id=me.id)
     return ""
 
 
 # ------------------------------------------ My PAYMENTS  -----------------------------------------
 
 
-@router.get("/payments", response_model=r.DefaultResponse)
-def get_my_payments(me: current_user):
+@router.get("/payments", response_model=bp.GetPayments)
+def get_my_payments(
+    db: dbSession, me: current_user, page: pageParams, stream: streamRequested
+):
+    """Send the header Accept: application/x-ndjson to stream all your payments"""
+    if stream:
+        batches = PaymentCrud.stream_payments_for_user(db, me.id, page.after_id)
+        return ndjson_response(batches, schema=bp.PaymentOut)
+
     try:
-        my_payments = PaymentCrud.get_payments_for_user(user_id=me.id)
+        my_payments, next_cursor = PaymentCrud.get_payments_for_user(
+            db, user_id=me.id, page=page
+        )
     except QueryExecError:
         eu.RaiseHttpException.server_error("Error fetching your payments.")
-    return r.DefaultResponse(
-        data=eu.handle_records(records=my_payments, table_name="payments")
+    return trusted_response(
+        bp.GetPayments(
+            data=eu.handle_records(records=my_payments, table_name="payments"),
+            next_cursor=next_cursor,
+        )
     )
 
 
 @router.post('/payments', response_model=r.DefaultResponse)
-def make_payment(
-    db: dbSession, me: current_user, payment: Annotated[bp.PaymentCreate, Body()]
+async def make_payment(
+    db: asyncDbSession, me: current_user, payment: Annotated[bp.PaymentCreate, Body()]
 ):
-    bills = BillCrud.get_bills_for_user(db, me.id)
-
-    # current user has no bills
-    if len(bills) == 0:
-        eu.raise_400_exception("You currently have no bills")
-
-    # Ensure the referenced bill belongs to the current user
-    if len([bill for bill in bills if bill.id == payment.bill_id]) == 0:
-        msg = "You did not create the bill you are trying to make payment on"
-        eu.RaiseHttpException.forbidden(msg)
-
     try:
         res_msg = "Payment created successfully!"
-        db_payment = PaymentCrud.create(db, payment)
+        db_payment = await PaymentCrud.async_create(db, payment, user_id=me.id)
     except CreatePaymentException as e:
         eu.raise_400_exception(str(e))
     else:
-        return r.DefaultResponse(message=res_msg, data=db_payment)
+        payment_out = bp.PaymentOut.from_orm(db_payment)
+        return r.DefaultResponse(message=res_msg, data=payment_out)
+
+
+# ----------------------------------- MY ANALYTICS -----------------------------------
+
+MAX_ANALYTICS_DAYS = {"day": 366, "week": 7 * 520, "month": 31 * 240}
+
+
+@router.get("/analytics", response_model=bp.GetPaymentAnalytics)
+async def get_my_analytics(
+    db: asyncDbSession,
+    me: current_user,
+    start: datetime = Query(alias="from"),
+    end: datetime = Query(alias="to", default=None),
+    bucket: Literal["day", "week", "month"] = Query(default="month"),
+):
+    """Returns the user's payment totals per time bucket (UTC) and creditor
+
+    - **from**: Start of the period. Buckets overlapping the period are returned whole
+    - **to**: End of the period, now by default
+    - **bucket**: day, week (starting on Monday) or month
+    """
+    start = to_naive_utc(start)
+    end = to_naive_utc(end) if end else datetime.utcnow()
+
+    if start >= end:
+        eu.raise_400_exception("from must be earlier than to")
+
+    if (end - start).days > MAX_ANALYTICS_DAYS[bucket]:
+        eu.raise_400_exception(f"The period is too long for {bucket} buckets")
+
+    aggregates = await PaymentCrud.async_get_analytics(db, me.id, bucket, start, end)
+    return bp.GetPaymentAnalytics(data=aggregates)
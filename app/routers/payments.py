@@ -1,14 +1,18 @@
 from pydantic import Field
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import joinedload
 from typing import Annotated
-from fastapi import APIRouter, Query, Path, Body, Depends
+from fastapi import APIRouter, Path, Body, Depends
 
 from app.dependencies import auth
 
-from app.utils.database import dbSession
+from app.utils.database import asyncDbSession
+from app.utils.pagination import pageParams
+from app.utils.streaming import streamRequested, ndjson_response
 from app.utils import error_utils as eu
-from app.schema.user import UserAllInfo
+from app.utils.responses import trusted_response
 from app.schema import bill_payment as bp
-from app.crud.bills import BillCrud
+from app.models import Payment
 from app.crud.payments import PaymentCrud, CreatePaymentException
 
 
@@ -19,6 +23,9 @@ class PaymentWithOwnerBill(bp.PaymentOut):
     owner: bp.BillOut = Field(alias="owner_bill")
 
 
+payment_with_owner_bill_options = [joinedload(Payment.owner_bill)]
+
+
 router = APIRouter(
     prefix="/payments", tags=["payments"], dependencies=[auth.current_active_user]
 )
@@ -29,49 +36,83 @@ router = APIRouter(
     response_model=bp.PaymentOut,
     status_code=201,
 )
-def create_payment(db: dbSession, payment_data: Annotated[bp.PaymentCreate, Body()]):
+async def create_payment(
+    db: asyncDbSession, payment_data: Annotated[bp.PaymentCreate, Body()]
+):
     try:
-        return PaymentCrud.create(db=db, payment=payment_data)
+        return await PaymentCrud.async_create(db=db, payment=payment_data)
     except CreatePaymentException as e:
         eu.RaiseHttpException.bad_request(str(e))
 
 
+@router.post(
+    "/batch",
+    response_model=bp.PaymentBatchResponse,
+    status_code=201,
+    dependencies=allow_staff_admin,
+)
+async def create_payments_batch(
+    db: asyncDbSession, payments: Annotated[bp.PaymentBatchCreate, Body()]
+):
+    """Records up to MAX_PAYMENT_BATCH_SIZE payments in a single transaction
+
+    Returns one result per payment, in the order they were sent
+    """
+    try:
+        results = await PaymentCrud.async_create_batch(db, payments)
+    except DBAPIError as e:
+        # asyncpg errors other than integrity ones surface as plain DBAPIError
+        await db.rollback()
+        eu.handle_payments_dbapi_exception(getattr(e.orig, "sqlstate", None))
+
+    recorded = len([result for result in results if result.success])
+    return bp.PaymentBatchResponse(
+        message=f"Recorded {recorded} of {len(results)} payments",
+        data=results,
+    )
+
+
 @router.get(
     "/",
-    response_model=list[bp.PaymentOut],
+    response_model=bp.GetPayments,
     dependencies=[Depends(auth.restrict_to("staff", "admin"))],
 )
-def get_payments(
-    db: dbSession, skip: int = Query(default=0), limit: int = Query(default=100)
-):
-    payments = PaymentCrud.get_records(db=db, skip=skip, limit=limit)
-    return eu.handle_records(records=payments, table_name="payments")
+async def get_payments(db: asyncDbSession, page: pageParams, stream: streamRequested):
+    """Send the header Accept: application/x-ndjson to stream every payment"""
+    if stream:
+        batches = PaymentCrud.async_stream_records(db, after_id=page.after_id)
+        return ndjson_response(batches, schema=bp.PaymentOut)
+
+    payments, next_cursor = await PaymentCrud.async_get_records(db=db, page=page)
+    return trusted_response(
+        bp.GetPayments(
+            data=eu.handle_records(records=payments, table_name="payments"),
+            next_cursor=next_cursor,
+        )
+    )
+
+
+# Admins and staffs have unlimited access to get a payment
+payment_owner_only = auth.restrict_to_owner(
+    PaymentCrud,
+    not_found_msg="The payment was not found",
+    forbidden_msg="You can only get a payment you made",
+)
 
 
 @router.get(
     "/{id}",
     status_code=200,
     response_model=PaymentWithOwnerBill,
+    dependencies=[Depends(payment_owner_only)],
 )
-def get_payment(
-    db: dbSession,
-    id: Annotated[int, Path()],
-    user: Annotated[UserAllInfo, auth.current_active_user],
-):
+async def get_payment(db: asyncDbSession, id: Annotated[int, Path()]):
     eu.ensure_positive_int(num=id)
-    payment = PaymentCrud.get_by_id(db, id)
+    payment = await PaymentCrud.async_get_by_id(
+        db, id, options=payment_with_owner_bill_options
+    )
 
     if payment is None:
         eu.RaiseHttpException.not_found("The payment was not found")
 
-    # Admins and staffs have unlimited access to get a payment
-    # Alt users.role == 'user', however more roles might be added eg 'creditiors' which would break the check
-    if user.role not in ("admin", "staff"):
-        users_bills = BillCrud.get_bills_for_user(db, user_id=user.id)
-
-        # Ensure only a user who made a payment can view it
-        if len([bill for bill in users_bills if bill.id == payment.bill_id]) == 0:
-            message = "You can only get a payment you made"
-            eu.RaiseHttpException.forbidden(message)
-
     return payment
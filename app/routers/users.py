@@ -1,17 +1,25 @@
 from typing import Annotated
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 from fastapi import APIRouter, Path, Query, Body, Depends
 
 from app.utils.database import dbSession
+from app.utils.pagination import pageParams
+from app.utils.streaming import streamRequested, ndjson_response
 from app.utils import error_utils as eu
 from app.utils.custom_exceptions import DataError
+from app.utils.responses import trusted_response
 
+from app.models import User
 from app.crud.users import UserCrud
 from app.schema import user as u
 from app.schema.response import DefaultResponse
 from app.dependencies import auth
 from app.dependencies.user_multipart import handle_user_multipart_data_create
 
+# GetUser serializes the user's bills
+user_with_bills_options = [selectinload(User.user_bills)]
+
 router = APIRouter(
     prefix="/users", tags=["users"], dependencies=[auth.current_active_user]
 )
@@ -62,14 +70,19 @@ def update_user(
     status_code=200,
     dependencies=allow_admin_staff,
 )
-def get_all_users(
-    db: dbSession,
-    skip: int = Query(default=0),
-    limit: int = Query(default=100),
-):
-    users = UserCrud.get_records(db=db, skip=skip, limit=limit)
-    return u.GetUsers(
-        message="Success", data=eu.handle_records(records=users, table_name="users")
+def get_all_users(db: dbSession, page: pageParams, stream: streamRequested):
+    """Send the header Accept: application/x-ndjson to stream every user"""
+    if stream:
+        batches = UserCrud.stream_records(db, after_id=page.after_id)
+        return ndjson_response(batches, schema=u.UserOut)
+
+    users, next_cursor = UserCrud.get_records(db=db, page=page)
+    return trusted_response(
+        u.GetUsers(
+            message="Success",
+            data=eu.handle_records(records=users, table_name="users"),
+            next_cursor=next_cursor,
+        )
     )
 
 
@@ -86,7 +99,7 @@ def get_user(
     email: u.EmailStr = Query(default=None),
 ):
     if id > 0:
-        user = UserCrud.get_by_id(db=db, id=id)
+        user = UserCrud.get_by_id(db=db, id=id, options=user_with_bills_options)
     else:
         if phone is None and email is None:
             eu.RaiseHttpException.bad_request(
@@ -94,9 +107,13 @@ def get_user(
             )
 
         if phone:
-            user = UserCrud.get_by_phone(db=db, phone=phone)
+            user = UserCrud.get_by_phone(
+                db=db, phone=phone, options=user_with_bills_options
+            )
         else:  # Email address
-            user = UserCrud.get_by_email(db=db, email=email)
+            user = UserCrud.get_by_email(
+                db=db, email=email, options=user_with_bills_options
+            )
 
     if user is None:
         eu.RaiseHttpException.not_found(msg="User not found")
@@ -1,6 +1,10 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, conlist, condecimal
 from datetime import datetime
 
+from app.schema.response import DefaultResponse, PaginatedResponse
+
+MAX_PAYMENT_BATCH_SIZE = 5000
+
 
 class MyBillCreate(BaseModel):
     creditor_id: int
@@ -37,6 +41,23 @@ class PaymentCreate(BaseModel):
     amount: float
 
 
+class PaymentBatchItem(PaymentCreate):
+    # Bounded like payments.amount, an out of range amount fails the whole batch
+    amount: condecimal(max_digits=10, decimal_places=2, gt=0)
+
+
+PaymentBatchCreate = conlist(
+    PaymentBatchItem, min_items=1, max_items=MAX_PAYMENT_BATCH_SIZE
+)
+
+
+class PaymentBatchItemResult(BaseModel):
+    index: int
+    success: bool
+    id: int = None
+    error: str = None
+
+
 class PaymentOut(PaymentCreate):
     id: int
     created_at: datetime
@@ -44,3 +65,45 @@ class PaymentOut(PaymentCreate):
 
     class Config:
         orm_mode = True
+
+
+# BALANCE SUMMARY
+class BalanceSummaryOut(BaseModel):
+    total_credit: float = 0.00
+    total_paid: float = 0.00
+    outstanding: float = 0.00
+    open_bill_count: int = 0
+    last_payment_at: datetime = None
+
+    class Config:
+        orm_mode = True
+
+
+# PAYMENT ANALYTICS
+class PaymentAnalyticsItem(BaseModel):
+    bucket_start: datetime
+    creditor_id: int
+    creditor_name: str
+    total_amount: float
+    payment_count: int
+
+
+# RESPONSE
+class GetBills(PaginatedResponse):
+    data: list[BillOut]
+
+
+class GetPayments(PaginatedResponse):
+    data: list[PaymentOut]
+
+
+class PaymentBatchResponse(DefaultResponse):
+    data: list[PaymentBatchItemResult]
+
+
+class GetBalanceSummary(DefaultResponse):
+    data: BalanceSummaryOut
+
+
+class GetPaymentAnalytics(DefaultResponse):
+    data: list[PaymentAnalyticsItem]
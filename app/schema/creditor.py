@@ -3,6 +3,7 @@ from datetime import datetime
 
 from app.schema.user import e_164_phone_regex
 from app.schema.commons import Update
+from app.schema.response import PaginatedResponse
 
 
 class CreditorCreateOptional(BaseModel):
@@ -28,6 +29,9 @@ class CreditorOwner(BaseModel):
 class MyCreditorOut(MyCreditorCreate):
     id: int
 
+    class Config:
+        orm_mode = True
+
 
 class CreditorCreate(MyCreditorCreate, CreditorOwner):
     pass
@@ -52,3 +56,12 @@ class CreditorAllInfo(CreditorOut):
 
     class Config:
         orm_mode = True
+
+
+# RESPONSE
+class GetMyCreditors(PaginatedResponse):
+    data: list[MyCreditorOut]
+
+
+class GetCreditors(PaginatedResponse):
+    data: list[CreditorOut]
@@ -6,3 +6,7 @@ class DefaultResponse(BaseModel):
     success: bool = True
     message: str = "Success!"
     data: Any = None
+
+
+class PaginatedResponse(DefaultResponse):
+    next_cursor: str = None
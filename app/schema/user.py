@@ -5,7 +5,7 @@ from app.utils.error_utils import RaiseHttpException
 
 from app.schema.bill_payment import BillOut
 from app.schema.commons import Update
-from app.schema.response import DefaultResponse
+from app.schema.response import DefaultResponse, PaginatedResponse
 
 """
 USER PASSWORD REGEX REQUIREMENTS
@@ -115,18 +115,8 @@ class UserAuthSuccess(BaseModel):
     message: str
 
 
-class UserSignUp(UserCreate):
-    otp: str = None
-    otp_expires_at: datetime = None
-
-    class Config:
-        orm_mode = True
-
-
 # Password must never ever ever ever be sent from our server
 class UserAllInfo(UserOut):
-    otp: str = None
-    otp_expires_at: datetime = None
     is_active: bool = True
     created_at: datetime
     verified: bool
@@ -140,7 +130,7 @@ class UserAllInfo(UserOut):
 
 
 # RESPONSE
-class GetUsers(DefaultResponse):
+class GetUsers(PaginatedResponse):
     data: list[UserOut]
 
 
@@ -1,5 +1,8 @@
 import re
-from bcrypt import checkpw
+import hmac
+import time
+from hashlib import sha256
+from bcrypt import checkpw, gensalt, hashpw
 from random import randint
 from fastapi import Response
 from jose import jwt, JWTError
@@ -7,6 +10,9 @@ from datetime import timedelta, datetime
 
 from app.schema.user import UserAuthSuccess, UserOut, UserAllInfo
 from app.settings import settings
+from app.utils.cache import TTLCache
+from app.utils.executors import BoundedExecutor
+from app.utils.custom_exceptions import ExecutorBusyError
 from app.utils.database import Session
 from app.utils.error_utils import RaiseHttpException
 
@@ -24,6 +30,23 @@ JWT_ALGORITYHM = settings.jwt_algorithm
 JWT_EXPIRES_AFTER = settings.jwt_expires_after
 ACEESS_TOKEN_COOKIE_KEY = settings.cookie_key
 EXPIRED_JWT_MESSAGE = "Your session has expired. Please login"
+INVALID_OTP_MESSAGE = "The one time password (otp) is invalid or has expired"
+
+# Verified token payloads by token digest, each kept until the token's exp
+token_cache = TTLCache(
+    maxsize=settings.jwt_cache_max_size if settings.jwt_cache_enabled else 0,
+    ttl=0,
+)
+
+# bcrypt runs here rather than on the event loop or the request threadpool
+password_executor = BoundedExecutor(
+    name="password",
+    kind=settings.password_executor_kind,
+    max_workers=settings.password_executor_workers,
+    max_pending=settings.password_executor_max_pending,
+    timeout=settings.password_executor_timeout_secs,
+)
+PASSWORD_BUSY_MESSAGE = "Too many login attempts in progress. Try again shortly"
 
 # TOKEN-COOKIE DATE-TIME CONFIG
 CURRENT_UTC_TIME = datetime.utcnow()
@@ -32,21 +55,6 @@ AUTH_COOKIE_EXPIRES = get_timestamp_secs(TOKEN_EXPIRES)
 LOGOUT_COOKIE_EXPIRES = get_timestamp_secs(CURRENT_UTC_TIME + timedelta(seconds=1))
 
 
-def set_otp_columns_data(
-    otp: str = None, otp_expires: datetime = None, verified: bool = False
-):
-    """
-    Returns a dictionary for updating the db user's otp columns
-    """
-    otp_expires_is_date = isinstance(otp_expires, datetime)
-    verified_is_bool = isinstance(verified, bool)
-    assert otp is None or isinstance(otp, str), "otp must be a string"
-    assert otp_expires is None or otp_expires_is_date, "otp_expires must be a datetime"
-    assert verified is None or verified_is_bool, "verified must be a boolean"
-
-    return {"otp": otp, "otp_expires_at": otp_expires, "verified": verified}
-
-
 def generate_otp(num_of_digits: int = 4):
     """
     Returns a random sequence of positive integers as strings
@@ -55,6 +63,14 @@ def generate_otp(num_of_digits: int = 4):
     return "".join(otp_digits)
 
 
+def hash_otp(otp: str, purpose: str) -> str:
+    """
+    Returns the keyed hash an otp is stored and looked up by
+    """
+    message = f"{purpose}:{otp}".encode("utf-8")
+    return hmac.new(JWT_SECRET.encode("utf-8"), message, sha256).hexdigest()
+
+
 def create_access_token(data: dict) -> str:
     """Create a new access token"""
     assert isinstance(data, dict), "data must be a dict"
@@ -84,13 +100,19 @@ def handle_create_token_for_user(user: UserAllInfo) -> str:
 
 def handle_decode_access_token(access_token: str) -> dict:
     """
-    Return a decoded access token
+    Return a decoded access token. Tokens verified before are served from the
+    token cache until they expire
     """
+    token_digest = sha256(access_token.encode("utf-8")).digest()
+    payload = token_cache.get(token_digest)
+    if payload is not None:
+        return payload.copy()
+
     if not validate_token_anatomy(access_token):
         RaiseHttpException.unauthorized_with_headers("Invalid access token")
 
     try:
-        return jwt.decode(access_token, JWT_SECRET, algorithms=JWT_ALGORITYHM)
+        payload = jwt.decode(access_token, JWT_SECRET, algorithms=JWT_ALGORITYHM)
     except JWTError as e:
         error_msg = str(e)
         if "Signature has expired" in error_msg:
@@ -100,35 +122,89 @@ def handle_decode_access_token(access_token: str) -> dict:
             RaiseHttpException.unauthorized_with_headers(msg="Invalid access token")
 
         RaiseHttpException.unauthorized_with_headers()
+    else:
+        # Tokens without an exp get a ttl of 0 and are never cached
+        token_cache.set(token_digest, payload, ttl=payload.get("exp", 0) - time.time())
+        return payload.copy()
+
+
+def bcrypt_hash(password: str, rounds: int) -> bytes:
+    return hashpw(password.encode("utf-8"), gensalt(rounds=rounds))
+
+
+def bcrypt_check(plain_password: str, hashed_password: bytes) -> bool:
+    return checkpw(plain_password.encode("utf-8"), hashed_password)
+
+
+def hash_password(password: str) -> bytes:
+    """Hashes a password on the password executor with the configured cost"""
+    try:
+        return password_executor.run(bcrypt_hash, password, settings.bcrypt_rounds)
+    except ExecutorBusyError:
+        RaiseHttpException.service_unavailable(PASSWORD_BUSY_MESSAGE)
+
+
+async def async_hash_password(password: str) -> bytes:
+    try:
+        return await password_executor.async_run(
+            bcrypt_hash, password, settings.bcrypt_rounds
+        )
+    except ExecutorBusyError:
+        RaiseHttpException.service_unavailable(PASSWORD_BUSY_MESSAGE)
 
 
 def authenticate_password(plain_password: str, hashed_password: bytes) -> bool:
     """Checks a plain text password against a hashed password"""
-    return checkpw(plain_password.encode("utf-8"), hashed_password)
+    try:
+        return password_executor.run(bcrypt_check, plain_password, hashed_password)
+    except ExecutorBusyError:
+        RaiseHttpException.service_unavailable(PASSWORD_BUSY_MESSAGE)
 
 
-def handle_get_user_by_otp(db: Session, otp: str):
-    from app.crud.users import UserCrud  # Last resort to Circular-Import issues
+async def async_authenticate_password(
+    plain_password: str, hashed_password: bytes
+) -> bool:
+    try:
+        return await password_executor.async_run(
+            bcrypt_check, plain_password, hashed_password
+        )
+    except ExecutorBusyError:
+        RaiseHttpException.service_unavailable(PASSWORD_BUSY_MESSAGE)
+
+
+def password_needs_rehash(hashed_password: bytes) -> bool:
+    """True when the hash was made with a cost other than settings.bcrypt_rounds"""
+    # bcrypt hashes look like $2b$<cost>$<salt and hash>
+    return int(hashed_password.split(b"$")[2]) != settings.bcrypt_rounds
+
+
+def handle_consume_user_otp(db: Session, otp: str, purposes: list[str], user_id: int):
+    """
+    Consumes an otp issued to the user. Raises HttpException if the otp isn't one
+    of the user's, is invalid or has expired
+    """
+    from app.crud.otps import OtpCrud  # Last resort to Circular-Import issues
 
     if otp is None:
         RaiseHttpException.bad_request("Provide the user's otp")
 
-    user = UserCrud.get_user_by_otp(db, otp)
+    if not OtpCrud.consume(db, otp, purposes, user_id):
+        RaiseHttpException.unauthorized_with_headers(INVALID_OTP_MESSAGE)
 
-    if user is None:
-        RaiseHttpException.unauthorized_with_headers("Invalid login credentilas")
 
-    return user
+def handle_verify_user_by_otp(db: Session, otp: str):
+    """
+    Consumes a login otp and returns its now verified user. Raises HttpException if
+    the otp is invalid or has expired
+    """
+    from app.crud.users import UserCrud  # Last resort to Circular-Import issues
 
+    user = UserCrud.verify_user_by_otp(db, otp)
 
-def check_otp_expired(otp_exp_time: datetime):
-    # Get datetime as timestamps
-    current_timestamp = get_timestamp_secs(datetime.utcnow())
-    otp_expire_timestamp = get_timestamp_secs(otp_exp_time)
+    if user is None:
+        RaiseHttpException.unauthorized_with_headers(INVALID_OTP_MESSAGE)
 
-    # Raise HttpException is otp has expired.
-    if current_timestamp > otp_expire_timestamp:
-        RaiseHttpException.bad_request("The one time password (otp) has expired")
+    return user
 
 
 def get_auth_success_response(token: str, user_orm_data=None, message: str = "Success"):
@@ -168,7 +244,7 @@ def validate_phone_number(phone):
 
 
 def handle_credentials_to_update_config(data: dict):
-    update_data = set_otp_columns_data(verified=True)
+    update_data = {"verified": True}
     update_data.update(data)
     return update_data
 
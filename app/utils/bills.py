@@ -2,14 +2,15 @@ from sqlalchemy.exc import IntegrityError
 
 from app.schema import bill_payment as bp, response as r
 from app.crud.bills import BillCrud
-from app.utils.database import dbSession
+from app.utils.database import asyncDbSession
 from app.utils import error_utils as eu
 
 
-def handle_make_bill(db: dbSession, bill: dict):
+async def handle_make_bill(db: asyncDbSession, bill: dict):
     try:
-        new_bill = BillCrud.create(db, bill=bp.BillCreate(**bill))
+        new_bill = await BillCrud.async_create(db, data=bp.BillCreate(**bill))
     except IntegrityError as e:
+        await db.rollback()
         eu.handle_bills_integrity_exception((str(e)))
     else:
         return r.DefaultResponse(data=bp.BillOut.from_orm(new_bill))
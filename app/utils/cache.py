@@ -0,0 +1,99 @@
+import time
+from threading import Lock
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    A size bounded, least recently used mapping whose entries expire
+
+    Entries live for ttl seconds unless set with their own ttl. The cache is per
+    worker process and safe to share between the event loop and threadpool threads.
+
+    Every pop moves the key to a new generation. A value loaded from the database
+    is set with the generation read before loading it, and is dropped if the key
+    was popped meanwhile, so a stale copy can't be cached after an update.
+    """
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # The generation of each key's last pop, oldest first. Keys pushed out of
+        # it count as popped at the newest generation that was pushed out
+        self._generation = 0
+        self._popped: OrderedDict = OrderedDict()
+        self._popped_floor = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._data[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def generation(self, key) -> int:
+        with self._lock:
+            return self._popped.get(key, self._popped_floor)
+
+    def set(self, key, value, ttl: float = None, generation: int = None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+
+        with self._lock:
+            if generation is not None:
+                if generation != self._popped.get(key, self._popped_floor):
+                    return
+
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+
+            self._generation += 1
+            self._popped[key] = self._generation
+            self._popped.move_to_end(key)
+            while len(self._popped) > self.maxsize:
+                _, self._popped_floor = self._popped.popitem(last=False)
+
+            return entry and entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+            self._popped.clear()
+            self._popped_floor = self._generation
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_size": self.maxsize,
+                "ttl_secs": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+            }
@@ -14,6 +14,10 @@ class ImageTooSmallException(Exception):
     pass
 
 
+class ImageTooLargeException(Exception):
+    pass
+
+
 class DataError(Exception):
     pass
 
@@ -32,3 +36,11 @@ class QueryExecError(Exception):
 
 class DeleteRecordError(Exception):
     pass
+
+
+class ImportCsvError(Exception):
+    pass
+
+
+class ExecutorBusyError(Exception):
+    pass
@@ -1,8 +1,9 @@
 from fastapi import Depends
 from typing import Annotated
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database.sqlalchemy_config import SessionLocal
+from app.database.sqlalchemy_config import SessionLocal, AsyncSessionLocal
 
 
 class DbContextManager:
@@ -21,4 +22,10 @@ def db_init():
         yield db
 
 
+async def async_db_init():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 dbSession = Annotated[Session, Depends(db_init)]
+asyncDbSession = Annotated[AsyncSession, Depends(async_db_init)]
@@ -22,6 +22,14 @@ class RaiseHttpException:
     def unauthorized(cls, msg: str = "Unauthorized!"):
         raise HTTPException(status_code=401, detail=msg)
 
+    @classmethod
+    def payload_too_large(cls, msg: str = "Payload Too Large!"):
+        raise HTTPException(status_code=413, detail=msg)
+
+    @classmethod
+    def service_unavailable(cls, msg: str = "Service Unavailable! Try again later"):
+        raise HTTPException(status_code=503, detail=msg)
+
     @classmethod
     def unauthorized_with_headers(
         cls,
@@ -78,6 +86,21 @@ def handle_bills_integrity_exception(error_message: str):
     RaiseHttpException.server_error()
 
 
+# The postgres SQLSTATE of a value out of range for its numeric column
+NUMERIC_VALUE_OUT_OF_RANGE = "22003"
+
+
+def handle_payments_dbapi_exception(sqlstate: str | None):
+    # The amounts are bounded by the schema, so an overflow means a bill's total
+    # went out of range
+    if sqlstate == NUMERIC_VALUE_OUT_OF_RANGE:
+        raise_400_exception(
+            "A bill's total would be out of range. None of the payments were recorded"
+        )
+
+    RaiseHttpException.server_error()
+
+
 def handle_creditors_integrity_exception(error_message: str):
     if "creditors_name_key" in error_message:
         raise_400_exception("The creditor with this name already exists")
@@ -0,0 +1,130 @@
+import time
+import asyncio
+from threading import Lock
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+
+from app.utils.custom_exceptions import ExecutorBusyError
+
+
+class BoundedExecutor:
+    """
+    A thread or process pool for cpu bound work that admits at most max_pending jobs
+
+    A job beyond max_pending is rejected right away and a job without a result
+    after timeout seconds is abandoned (cancelled if it hasn't started). Both raise
+    ExecutorBusyError, so callers never pile up behind an overloaded pool.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        kind: str = "thread",
+        max_workers: int = 2,
+        max_pending: int = 64,
+        timeout: float = 10.0,
+    ) -> None:
+        assert kind in ("thread", "process"), "kind must be 'thread' or 'process'"
+        assert max_pending >= max_workers, "max_pending must be at least max_workers"
+
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._executor: Executor = None
+        self._lock = Lock()
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.latency_total_secs = 0.0
+        self.latency_max_secs = 0.0
+
+    def _get_executor(self) -> Executor:
+        # Created on first use so importing this module never spawns workers
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix=self.name
+                )
+        return self._executor
+
+    def _on_done(self, future: Future, started: float):
+        latency = time.perf_counter() - started
+
+        with self._lock:
+            self.pending -= 1
+            if not future.cancelled():
+                self.completed += 1
+                self.latency_total_secs += latency
+                self.latency_max_secs = max(self.latency_max_secs, latency)
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise ExecutorBusyError(f"The {self.name} executor is busy")
+
+            self.pending += 1
+            self.submitted += 1
+            executor = self._get_executor()
+
+        started = time.perf_counter()
+        try:
+            future = executor.submit(fn, *args)
+        except RuntimeError:  # Shut down
+            with self._lock:
+                self.pending -= 1
+            raise ExecutorBusyError(f"The {self.name} executor is shut down")
+
+        future.add_done_callback(lambda f: self._on_done(f, started))
+        return future
+
+    def _record_timeout(self, future: Future):
+        future.cancel()
+        with self._lock:
+            self.timeouts += 1
+
+    def run(self, fn, *args):
+        """Runs fn(*args) on the pool and blocks the calling thread for the result"""
+        future = self._submit(fn, *args)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self._record_timeout(future)
+            raise ExecutorBusyError(f"The {self.name} executor timed out")
+
+    async def async_run(self, fn, *args):
+        """Runs fn(*args) on the pool and awaits the result"""
+        future = self._submit(fn, *args)
+
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            self._record_timeout(future)
+            raise ExecutorBusyError(f"The {self.name} executor timed out")
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            avg = self.latency_total_secs / self.completed if self.completed else 0
+            return {
+                "kind": self.kind,
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "total_submitted": self.submitted,
+                "total_completed": self.completed,
+                "total_rejected": self.rejected,
+                "total_timeouts": self.timeouts,
+                "avg_latency_ms": round(avg * 1000, 3),
+                "max_latency_ms": round(self.latency_max_secs * 1000, 3),
+            }
@@ -1,75 +1,431 @@
 import io
 import os
-import random
-import time
+import re
+import hashlib
+from abc import ABC, abstractmethod
+from typing import Iterator
+from tempfile import NamedTemporaryFile
 from PIL import Image
-from string import ascii_uppercase
 from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
 
-from app.utils.custom_exceptions import ImageTooSmallException
+from app.settings import settings
+from app.utils.cache import TTLCache
+from app.utils.executors import BoundedExecutor
+from app.utils.custom_exceptions import ImageTooSmallException, ImageTooLargeException
 
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MIN_IMAGE_SIDE = 180
+THUMBNAIL_SIZE = (500, 500)
+HASH_CHUNK_SIZE = 64 * 1024
+# A content addressed image name, or the name of one of its variants
+CONTENT_NAME_REGEX = re.compile(r"(?P<digest>[0-9a-f]{32})(_(?P<size>\d+))?\.\w+")
 
-def absolute_path_for_image(image_name):
-    """Returns an absolute path to the image in the /static/images/users/ dir"""
+VARIANT_MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+VARIANT_SAVE_OPTIONS = {
+    "webp": {"format": "WEBP", "quality": 80, "method": 4},
+    "jpeg": {"format": "JPEG", "quality": 85, "optimize": True, "progressive": True},
+}
 
-    workdir = os.path.abspath(os.getcwd())
-    return os.path.join(workdir, "app", "static", "images", 'users', image_name)
+# Decoding a large image is cpu bound and can take hundreds of MB, so it is done
+# in worker processes, never on a request thread
+image_executor = BoundedExecutor(
+    name="image",
+    kind="process",
+    max_workers=settings.image_executor_workers,
+    max_pending=settings.image_executor_max_pending,
+    timeout=settings.image_executor_timeout_secs,
+)
 
+# The bytes of the most requested images, for this worker only. Image names are
+# content addressed, so an entry can't go stale and needs no invalidation.
+image_cache = TTLCache(
+    maxsize=settings.image_cache_max_size, ttl=settings.image_cache_ttl_secs
+)
 
-def generate_random_image_name(file_extension: str = "png"):
+
+def content_image_name(digest: str, file_extension: str = "png") -> str:
     """
-    Returns a random url safe string with the given file extension
+    Returns the name of an image with the given content hash
 
-    Args:
-    file_extension (string): The extension of the file eg .png or .jpeg
+    The same content always gets the same name and a name never points to other
+    content, so the name doubles as a strong ETag and a cache busting version.
+    """
+    return f"{digest}.{file_extension}"
 
-    Returns:
-        str: The url safe string appended with the given file extension
+
+def new_content_hash(content: bytes = b""):
+    """The hash images are named after: 128 bits of blake2b"""
+    return hashlib.blake2b(content, digest_size=16)
+
+
+def image_etag(image_name: str) -> str:
+    """A strong ETag for the image, derived from its (unique) name"""
+    return f'"{image_name}"'
+
+
+def variant_image_name(image_name: str, size: int, file_extension: str) -> str:
+    """The name of the size pixels, file_extension encoded variant of the image"""
+    return f"{os.path.splitext(image_name)[0]}_{size}.{file_extension}"
+
+
+def source_image_name(image_name: str) -> str:
+    """The name of the image a variant was made from, the name itself otherwise"""
+    match = CONTENT_NAME_REGEX.fullmatch(image_name)
+    if match is None or match["size"] is None:
+        return image_name
+    return content_image_name(match["digest"])
+
+
+def nearest_variant_size(size: int) -> int:
+    """The smallest variant size that fits size, else the largest variant size"""
+    sizes = sorted(settings.image_variant_sizes)
+    return next((s for s in sizes if s >= size), sizes[-1])
+
+
+def negotiate_variant_format(accept: str | None) -> str:
+    """
+    Picks the first of settings.image_variant_formats the Accept header names.
+    A client naming none of them gets the last one, the most widely supported.
+    """
+    formats = settings.image_variant_formats
+    accept = accept or ""
+    return next((f for f in formats if VARIANT_MEDIA_TYPES[f] in accept), formats[-1])
+
+
+class ImageStorage(ABC):
+    """
+    Where images are kept, under their content addressed names
+
+    Saving content that is already stored only refreshes the stored image, so
+    identical images are kept once. Images no user refers to anymore are deleted
+    by the image cleanup job, see app.features.image_cleanup
     """
 
-    random_alphanumeric_str = "".join(random.choices(ascii_uppercase, k=7))
-    utc_timestamp_str = str(time.time()).replace(".", "")
-    random_str = "-".join([random_alphanumeric_str, utc_timestamp_str])
+    # Where uploads are spooled before they are saved. None for the system default
+    spool_dir: str | None = None
+
+    @abstractmethod
+    def save_bytes(self, content: bytes, image_name: str = None) -> str:
+        """Stores the content under image_name, by default its content addressed
+        name, and returns the name"""
+
+    @abstractmethod
+    def save_file(self, path: str) -> str:
+        """Moves the file at path into the storage and returns its image name"""
+
+    @abstractmethod
+    def read(self, image_name: str) -> bytes:
+        """Returns the image content. Raises FileNotFoundError if there is none"""
+
+    @abstractmethod
+    def exists(self, image_name: str) -> bool:
+        """Checks if the image is stored"""
+
+    @abstractmethod
+    def size(self, image_name: str) -> int:
+        """Returns the image size in bytes. Raises FileNotFoundError if there is none"""
+
+    @abstractmethod
+    def delete(self, image_name: str, saved_before: float = None) -> bool:
+        """Deletes the image and returns False if there was none. With saved_before,
+        an image saved again since that timestamp is kept and False returned"""
+
+    @abstractmethod
+    def iter_names(self, saved_before: float) -> Iterator[str]:
+        """Yields the names of the images last saved before the given timestamp"""
 
-    return f"{random_str}.{file_extension}"
+    def local_path(self, image_name: str) -> str | None:
+        """The path of the image on the local disk, if the storage keeps one"""
+        return None
 
 
-def store_image_file(file: UploadFile, location: str = 'users'):
+class LocalImageStorage(ImageStorage):
     """
-    Stores an image file in app/static/images/ directory
+    Keeps images on the local disk, fanned out into directories named after the
+    leading characters of their hash: root/90/54/905403b6...png. Variants are
+    kept next to their image.
 
-    Args:
-    file (UploadFile) : The file to uploaded
-    location (string) : The dir in the /static/images/ directory to store the image
-        If the directory does not exist, it will be created
+    With the default two levels of two hex characters, a million images make 65536
+    directories of about 15 files. Images named before names were content hashes
+    are kept at the root.
+    """
+
+    def __init__(self, root: str, shard_levels: int = 2, shard_width: int = 2):
+        self.root = root
+        self.shard_levels = shard_levels
+        self.shard_width = shard_width
+        self.spool_dir = os.path.join(root, ".uploads")
+
+    def local_path(self, image_name: str) -> str:
+        match = CONTENT_NAME_REGEX.fullmatch(image_name)
+        if match is None:
+            return os.path.join(self.root, image_name)
+
+        digest, width = match["digest"], self.shard_width
+        shards = [digest[i * width : (i + 1) * width] for i in range(self.shard_levels)]
+        return os.path.join(self.root, *shards, image_name)
+
+    @staticmethod
+    def _refresh(file_location: str) -> bool:
+        # Touched so the cleanup job sees a recently saved image
+        try:
+            os.utime(file_location)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def save_bytes(self, content: bytes, image_name: str = None) -> str:
+        if image_name is None:
+            image_name = content_image_name(new_content_hash(content).hexdigest())
+        file_location = self.local_path(image_name)
+
+        if not self._refresh(file_location):
+            directory = os.path.dirname(file_location)
+            os.makedirs(directory, exist_ok=True)
+            with NamedTemporaryFile(dir=directory, prefix=".", delete=False) as f:
+                f.write(content)
+            os.replace(f.name, file_location)
+
+        return image_name
+
+    def save_file(self, path: str) -> str:
+        content_hash = new_content_hash()
+        with open(path, mode="rb") as f:
+            while chunk := f.read(HASH_CHUNK_SIZE):
+                content_hash.update(chunk)
+
+        image_name = content_image_name(content_hash.hexdigest())
+        file_location = self.local_path(image_name)
+
+        if self._refresh(file_location):
+            os.remove(path)
+        else:
+            os.makedirs(os.path.dirname(file_location), exist_ok=True)
+            os.replace(path, file_location)
+
+        return image_name
+
+    def read(self, image_name: str) -> bytes:
+        with open(self.local_path(image_name), mode="rb") as f:
+            return f.read()
+
+    def exists(self, image_name: str) -> bool:
+        return os.path.exists(self.local_path(image_name))
+
+    def size(self, image_name: str) -> int:
+        return os.path.getsize(self.local_path(image_name))
+
+    def delete(self, image_name: str, saved_before: float = None) -> bool:
+        file_location = self.local_path(image_name)
+        try:
+            # Re-checked right before removing, an upload may have refreshed it
+            if saved_before is not None:
+                if os.stat(file_location).st_mtime >= saved_before:
+                    return False
+            os.remove(file_location)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def iter_names(self, saved_before: float) -> Iterator[str]:
+        # Dot entries are the spool directory and files being written
+        directories = [self.root] if os.path.isdir(self.root) else []
+        while directories:
+            with os.scandir(directories.pop()) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append(entry.path)
+                    elif entry.stat().st_mtime < saved_before:
+                        yield entry.name
+
+
+image_storage = LocalImageStorage(
+    os.path.join(os.path.abspath(os.getcwd()), "app", "static", "images", "users")
+)
+
+
+def read_image_bytes(image_name: str) -> bytes | None:
+    """
+    Reads the content of the image and keeps it in image_cache when small enough
 
     Returns:
-        str: The name of the saved image file
+        bytes | None: None if the image is too large to be cached and can be sent
+        from image_storage.local_path instead
+
+    Raises:
+        FileNotFoundError: If there is no such image
     """
+    max_bytes = settings.image_cache_max_file_bytes
+    if image_storage.local_path(image_name) is not None:
+        if image_storage.size(image_name) > max_bytes:
+            return None
 
-    # Ensure we have a users dir in our static/images/ directory
-    workdir = os.path.abspath(os.getcwd())
-    save_img_path = os.path.join(workdir, "app", "static", "images", location)
-    if not os.path.exists(save_img_path):
-        os.makedirs(save_img_path)
+    content = image_storage.read(image_name)
+    if len(content) <= max_bytes:
+        image_cache.set(image_name, content)
+    return content
 
-    image_name = generate_random_image_name()
-    file_location = os.path.join(save_img_path, image_name)
-    file_content = file.file.read()
 
-    # Save the image to file system
+def spool_upload(file: UploadFile, directory: str | None, max_bytes: int) -> str:
+    """
+    Copies the uploaded file chunk by chunk into a temporary file in directory
+
+    Raises:
+        ImageTooLargeException: As soon as more than max_bytes are read
+    """
+    file.file.seek(0)
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    spooled = NamedTemporaryFile(dir=directory, prefix=".upload-", delete=False)
+
     try:
-        img = Image.open(io.BytesIO(file_content))
+        with spooled:
+            size = 0
+            while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageTooLargeException
+                spooled.write(chunk)
+    except BaseException:
+        os.remove(spooled.name)
+        raise
+
+    return spooled.name
+
+
+def check_image_header(path: str, max_pixels: int) -> bool:
+    """
+    Checks the dimensions of an image read from its header, before any decoding
 
-        dimension = img.size
-        if dimension[0] < 180 and dimension[1] < 180:
-            raise ImageTooSmallException
+    Returns:
+        bool: False if the file isn't an image pillow can identify
 
-        img.thumbnail(size=(500, 500))
-        img.save(file_location)
+    Raises:
+        ImageTooSmallException: If both sides are under MIN_IMAGE_SIDE pixels
+        ImageTooLargeException: If the image has more than max_pixels pixels
+    """
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+    except Image.DecompressionBombError:
+        raise ImageTooLargeException
     except OSError:
-        # Backup file save mechanism
-        with open(file_location, mode="wb+") as f:
-            f.write(file_content)
+        return False
+
+    if width * height > max_pixels:
+        raise ImageTooLargeException
+
+    if width < MIN_IMAGE_SIDE and height < MIN_IMAGE_SIDE:
+        raise ImageTooSmallException
+
+    return True
+
+
+def receive_image_upload(file: UploadFile, directory: str | None) -> tuple[str, bool]:
+    """
+    Spools the upload to a temporary file and checks its image header
+
+    Returns:
+        tuple: The temporary file path and whether the file is an image
+    """
+    upload_path = spool_upload(file, directory, settings.image_max_upload_bytes)
+
+    try:
+        return upload_path, check_image_header(upload_path, settings.image_max_pixels)
+    except (ImageTooSmallException, ImageTooLargeException):
+        os.remove(upload_path)
+        raise
+
+
+def encode_image(img: Image.Image, **save_options) -> bytes:
+    buffer = io.BytesIO()
+    img.save(buffer, **save_options)
+    return buffer.getvalue()
+
+
+def without_alpha(img: Image.Image) -> Image.Image:
+    """The image in RGB, transparent areas made white, as jpeg has no alpha"""
+    if img.mode in ("RGB", "L"):
+        return img
+
+    img = img.convert("RGBA")
+    flattened = Image.new("RGB", img.size, "white")
+    flattened.paste(img, mask=img.getchannel("A"))
+    return flattened
+
+
+def make_variants(img: Image.Image, image_name: str, storage: ImageStorage):
+    """
+    Saves the image in each of settings.image_variant_sizes, as a square bound,
+    and settings.image_variant_formats, see variant_image_name
+    """
+    variant = img
+    # Each size is shrunk from the previous, larger one
+    for size in sorted(settings.image_variant_sizes, reverse=True):
+        variant = variant.copy()
+        variant.thumbnail(size=(size, size))
+
+        for file_extension in settings.image_variant_formats:
+            options = VARIANT_SAVE_OPTIONS[file_extension]
+            encodable = variant if file_extension != "jpeg" else without_alpha(variant)
+            storage.save_bytes(
+                encode_image(encodable, **options),
+                image_name=variant_image_name(image_name, size, file_extension),
+            )
+
+
+def make_thumbnail(src_path: str, storage: ImageStorage) -> str:
+    """
+    Shrinks the image to fit THUMBNAIL_SIZE, saves it as a png in storage along
+    with its variants. Runs in an image_executor process
+
+    Returns:
+        str: The content addressed name of the saved thumbnail
+    """
+    with Image.open(src_path) as img:
+        # jpeg images are scaled down while decoding, other formats ignore it
+        img.draft(img.mode, THUMBNAIL_SIZE)
+        img.thumbnail(size=THUMBNAIL_SIZE)
+        image_name = storage.save_bytes(encode_image(img, format="PNG"))
+        make_variants(img, image_name, storage)
 
     return image_name
+
+
+async def store_image_file(file: UploadFile, storage: ImageStorage = image_storage):
+    """
+    Stores an image file in the image storage
+
+    The upload is streamed to disk with its size capped, checked from its header
+    and then thumbnailed on the image_executor process pool. The image is named
+    after the hash of its stored content, see content_image_name.
+
+    Args:
+    file (UploadFile) : The file to uploaded
+    storage (ImageStorage) : Where to store the image
+
+    Returns:
+        str: The name of the saved image file
+
+    Raises:
+        ImageTooSmallException | ImageTooLargeException: If the image is rejected
+        ExecutorBusyError: If the image_executor can't take or finish the job
+    """
+    upload_path, is_image = await run_in_threadpool(
+        receive_image_upload, file, storage.spool_dir
+    )
+
+    # Save the image to the storage
+    try:
+        if is_image:
+            return await image_executor.async_run(make_thumbnail, upload_path, storage)
+        return await run_in_threadpool(storage.save_file, upload_path)
+    except OSError:
+        # Backup file save mechanism
+        return await run_in_threadpool(storage.save_file, upload_path)
+    finally:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
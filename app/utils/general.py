@@ -1,4 +1,4 @@
-from datetime import datetime, timedelta
+import re
 
 
 def to_bool_to_int(object: any):
@@ -65,15 +65,16 @@ def title_case_words(string) -> str:
     return " ".join(titled_words)
 
 
-def add_minutes(minutes: int = 5):
+def initcap_words(string: str) -> str:
     """
-    Returns the current datetime plus added minutes
-    Args:
-        minutes (int): The number of minutes to be added to the current datetime
-    Returns:
-        datetime (datetime): New datetime with added minutes
+    Upper cases the first letter of each word and lower cases the rest, like
+    postgres initcap. Words are runs of letters and digits, so "3rd" stays "3rd"
+    where str.title() gives "3Rd". The creditors csv import normalizes with
+    initcap, creditors created one by one must come out the same
     """
-    return datetime.utcnow() + timedelta(minutes=minutes)
+    return re.sub(
+        r"[^\W_]+", lambda word: word[0][0].upper() + word[0][1:].lower(), string
+    )
 
 
 def get_user_full_name(user):
@@ -0,0 +1,73 @@
+import json
+import binascii
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from dataclasses import dataclass
+from typing import Annotated
+from fastapi import Depends, Query
+
+from app.utils.error_utils import RaiseHttpException
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 200
+
+
+@dataclass
+class Page:
+    """A keyset page: the records with an id greater than after_id"""
+
+    after_id: int = 0
+    limit: int = DEFAULT_PAGE_SIZE
+
+    @property
+    def fetch_size(self) -> int:
+        """One extra record is fetched to know if there is a next page"""
+        return self.limit + 1
+
+
+def encode_cursor(last_id: int) -> str:
+    """Returns an opaque url safe cursor pointing after the record with last_id"""
+    return urlsafe_b64encode(json.dumps({"id": last_id}).encode()).decode()
+
+
+def decode_cursor(cursor: str | None) -> int:
+    """Returns the id the cursor points after. Raises HttpException if invalid"""
+    if not cursor:
+        return 0
+
+    try:
+        last_id = json.loads(urlsafe_b64decode(cursor.encode()))["id"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        RaiseHttpException.bad_request("Invalid pagination cursor")
+
+    if not isinstance(last_id, int) or last_id < 0:
+        RaiseHttpException.bad_request("Invalid pagination cursor")
+
+    return last_id
+
+
+def split_page(records: list, page: Page) -> tuple[list, str | None]:
+    """
+    Trims the extra fetched record off a page
+
+    Args:
+        records (list): Records fetched with page.fetch_size, ordered by id
+        page (Page): The requested page
+
+    Returns:
+        tuple: The page records and the cursor to the next page or None
+    """
+    if len(records) <= page.limit:
+        return records, None
+
+    records = records[: page.limit]
+    return records, encode_cursor(records[-1].id)
+
+
+def page_params(
+    cursor: str = Query(default=None, description="next_cursor of the previous page"),
+    limit: int = Query(default=DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+) -> Page:
+    return Page(after_id=decode_cursor(cursor), limit=limit)
+
+
+pageParams = Annotated[Page, Depends(page_params)]
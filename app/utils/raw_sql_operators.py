@@ -1,53 +1,112 @@
+from functools import lru_cache
+from operator import itemgetter
+from collections import namedtuple
 from typing import Callable
+from uuid import uuid4
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
 from psycopg2.errors import OperationalError, DatabaseError
 
-from app.database.psycopg_config import get_connection
-from app.schema.creditor import MyCreditorOut
-from app.schema.bill_payment import PaymentOut
 from app.utils.custom_exceptions import QueryExecError
+from app.utils.streaming import STREAM_BATCH_SIZE
 
 
-def map_to_creditor(result: tuple) -> MyCreditorOut:
-    return MyCreditorOut(
-        id=result[0],
-        name=result[1],
-        description=result[2],
-        street_address=result[3],
-        city=result[4],
-        state=result[5],
-        country=result[6],
-        phone=result[7],
-        email=result[8],
-        bank_name=result[9],
-        account_number=result[10],
-    )
-
-
-def map_to_payment(result: tuple) -> PaymentOut:
-    return PaymentOut(
-        id=result[0],
-        bill_id=result[1],
-        note=result[2],
-        issuer=result[3],
-        amount=result[4],
-        created_at=result[5],
-    )
-
-
-def execute_query(query, params, mapper: Callable):
+@lru_cache(maxsize=256)
+def compile_mapper(
+    schema: type[BaseModel], columns: tuple[str, ...], validate: bool = False
+) -> Callable[[tuple], object]:
+    """
+    Compiles a function mapping a row of the given columns to a record of schema
+
+    Columns are matched to the schema's fields by name, so the column order of a
+    SELECT * can change without breaking the mapping. Columns the schema doesn't
+    declare are dropped.
+
+    Args:
+        schema (BaseModel): The schema the records are meant for
+        columns (tuple): The column names of the result, from cursor.description
+        validate (bool): Build validated schema instances instead of records
+
+    Returns:
+        Callable: Maps a row tuple to a lightweight named tuple record, readable by
+        orm_mode schemas, or to a schema instance when validate is set
+    """
+    fields = [name for name in columns if name in schema.__fields__]
+    indexes = [columns.index(name) for name in fields]
+
+    record_type = namedtuple(f"{schema.__name__}Record", fields)
+    # itemgetter returns a bare value rather than a tuple for a single index
+    if len(indexes) > 1:
+        getter = itemgetter(*indexes)
+    else:
+
+        def getter(row: tuple):
+            return (row[indexes[0]],)
+
+    make_record = record_type._make
+
+    def to_record(row: tuple):
+        return make_record(getter(row))
+
+    def to_schema(row: tuple):
+        return schema.from_orm(make_record(getter(row)))
+
+    return to_schema if validate else to_record
+
+
+def row_mapper(cursor, schema: type[BaseModel], validate: bool = False):
+    """Returns the compiled mapper for the columns of the cursor's last query"""
+    columns = tuple(column.name for column in cursor.description)
+    return compile_mapper(schema, columns, validate)
+
+
+def execute_query(
+    db: Session,
+    query,
+    params,
+    schema: type[BaseModel],
+    validate: bool = False,
+    batch_size: int = STREAM_BATCH_SIZE,
+    server_side: bool = True,
+):
+    """
+    Runs a raw sql query on the session's pooled connection and lazily yields its
+    rows, mapped to schema records by column name (see compile_mapper), in batches
+
+    The connection is owned by the session, so it is neither opened nor closed here.
+    With server_side, the rows are held by a named cursor on the database and only
+    batch_size of them are fetched at a time, so memory use doesn't grow with the
+    size of the result. Set server_side to False for small, LIMITed queries where
+    the extra DECLARE and CLOSE round trips aren't worth it.
+
+    Args:
+        db (Session): The session whose connection runs the query
+        query (str): The sql query, with pyformat parameters
+        params (dict): The query parameters
+        schema (BaseModel): The schema the records are meant for
+        validate (bool): Yield validated schema instances instead of records
+        batch_size (int): The number of rows fetched and yielded at a time
+        server_side (bool): Fetch through a named (server side) cursor
+
+    Yields:
+        list: Up to batch_size mapped records. Nothing is yielded for no rows
+
+    Raises:
+        QueryExecError: If the query fails
+    """
     try:
-        conn = get_connection()
-        with conn.cursor() as cur:
+        conn = db.connection().connection
+        cursor_name = f"raw_query_{uuid4().hex}" if server_side else None
+        with conn.cursor(name=cursor_name) as cur:
             cur.execute(query, params)
-            records = cur.fetchall()
-            if len(records) == 0:
-                yield records
-            else:
-                results = []
-                for record in records:
-                    results.append(mapper(record))
-                yield results
+            # a named cursor only gets its description once rows are fetched
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                return
+
+            mapper = row_mapper(cur, schema, validate)
+            while rows:
+                yield [mapper(row) for row in rows]
+                rows = cur.fetchmany(batch_size)
     except (DatabaseError, OperationalError):
         raise QueryExecError
-    finally:
-        conn.close()
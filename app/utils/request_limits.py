@@ -0,0 +1,63 @@
+"""
+Caps the size of multipart request bodies while they arrive
+
+Starlette spools every part of a multipart form to a temporary file before the
+route runs, so a size check in the route only happens once the whole upload has
+been received. This middleware rejects a body that announces, or turns out to
+have, more than max_bytes as it is read. Only the routes listed in paths, as
+(method, path) pairs, are limited: other multipart uploads such as the creditors
+CSV import have their own size limit.
+"""
+from typing import Iterable
+from fastapi import HTTPException
+from fastapi.responses import ORJSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+TOO_LARGE_MESSAGE = "The request body is too large"
+
+
+class MultipartSizeLimitMiddleware:
+    def __init__(
+        self, app: ASGIApp, max_bytes: int, paths: Iterable[tuple[str, str]]
+    ) -> None:
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = {(method, path.rstrip("/")) for method, path in paths}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not self.is_limited(scope):
+            return await self.app(scope, receive, send)
+
+        content_length = self.header(scope, b"content-length")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            response = ORJSONResponse({"detail": TOO_LARGE_MESSAGE}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            # Bodies sent without a Content-Length are counted chunk by chunk.
+            # FastAPI lets an HTTPException raised while parsing the form through.
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail=TOO_LARGE_MESSAGE)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+    @staticmethod
+    def header(scope: Scope, name: bytes) -> str:
+        for key, value in scope["headers"]:
+            if key == name:
+                return value.decode("latin-1")
+        return ""
+
+    def is_limited(self, scope: Scope) -> bool:
+        if scope["type"] != "http":
+            return False
+        route = (scope["method"], scope["path"].rstrip("/"))
+        content_type = self.header(scope, b"content-type")
+        return route in self.paths and content_type.startswith("multipart/form-data")
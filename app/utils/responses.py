@@ -0,0 +1,88 @@
+import mimetypes
+from pydantic import BaseModel
+from fastapi import Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, ORJSONResponse
+
+from app.utils.file_operations import image_cache, image_etag, image_storage
+from app.utils.file_operations import read_image_bytes, variant_image_name
+from app.utils.file_operations import nearest_variant_size, negotiate_variant_format
+
+# For urls that name the image, the content behind them never changes
+IMMUTABLE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+# For urls whose image changes with the user's profile picture
+REVALIDATE_CACHE_CONTROL = "private, no-cache"
+
+
+def trusted_response(model: BaseModel, status_code: int = 200) -> ORJSONResponse:
+    """
+    Serializes an already validated response model straight to json with orjson
+
+    FastAPI hands Response objects back as they are, so the model isn't validated
+    a second time against the route's response_model nor run through
+    jsonable_encoder. Only pass an instance of the route's response_model.
+    """
+    return ORJSONResponse(content=model.dict(by_alias=True), status_code=status_code)
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Checks an If-None-Match header against the etag, the weak way as required"""
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == "*":
+        return True
+
+    tags = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in tags
+
+
+async def stored_image_response(request: Request, image_name: str, headers: dict):
+    """
+    Serves a stored image with a strong ETag, answering 304 when the client's copy
+    is current. Hot images are served from memory, see read_image_bytes
+
+    Raises:
+        FileNotFoundError: If there is no such image
+    """
+    headers = {**headers, "ETag": image_etag(image_name)}
+
+    if etag_matches(request.headers.get("If-None-Match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    content = image_cache.get(image_name)
+    if content is None:
+        content = await run_in_threadpool(read_image_bytes, image_name)
+    if content is None:
+        file_location = image_storage.local_path(image_name)
+        return FileResponse(file_location, headers=headers)
+
+    media_type = mimetypes.guess_type(image_name)[0] or "application/octet-stream"
+    return Response(content, media_type=media_type, headers=headers)
+
+
+async def image_response(
+    request: Request, image_name: str, cache_control: str, size: int = None
+):
+    """
+    Serves the image, or with a size, its variant nearest to size in a format the
+    client accepts. Images without variants are served as they are
+
+    Raises:
+        FileNotFoundError: If there is no such image
+    """
+    headers = {"Cache-Control": cache_control}
+
+    if size is not None:
+        headers["Vary"] = "Accept"
+        variant_name = variant_image_name(
+            image_name,
+            nearest_variant_size(size),
+            negotiate_variant_format(request.headers.get("Accept")),
+        )
+        try:
+            return await stored_image_response(request, variant_name, headers)
+        except FileNotFoundError:
+            pass  # Stored before variants were made, or not an image pillow reads
+
+    return await stored_image_response(request, image_name, headers)
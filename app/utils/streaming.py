@@ -0,0 +1,50 @@
+import orjson
+from typing import Annotated, AsyncIterable, Iterable
+from fastapi import Depends, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+STREAM_BATCH_SIZE = 1000
+
+
+def wants_ndjson(request: Request) -> bool:
+    """Checks if the client asked for a streamed newline delimited json response"""
+    return NDJSON_MEDIA_TYPE in request.headers.get("Accept", "")
+
+
+def ndjson_chunk(records: list, schema: type[BaseModel]) -> bytes:
+    """Serializes a batch of orm records into newline delimited json"""
+    return b"".join(
+        orjson.dumps(schema.from_orm(r).dict(by_alias=True)) + b"\n" for r in records
+    )
+
+
+def ndjson_response(batches: Iterable | AsyncIterable, schema: type[BaseModel]):
+    """
+    Streams batches of orm records as newline delimited json
+
+    Args:
+        batches (Iterable | AsyncIterable): Lists of records, fetched lazily
+        schema (BaseModel): The orm_mode schema each record is serialized with
+
+    Returns:
+        StreamingResponse: One json document per line, written batch by batch
+    """
+
+    if isinstance(batches, AsyncIterable):
+
+        async def content():
+            async for records in batches:
+                yield ndjson_chunk(records, schema)
+
+    else:
+
+        def content():
+            for records in batches:
+                yield ndjson_chunk(records, schema)
+
+    return StreamingResponse(content(), media_type=NDJSON_MEDIA_TYPE)
+
+
+streamRequested = Annotated[bool, Depends(wants_ndjson)]
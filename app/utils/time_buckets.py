@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta, timezone
+
+BUCKETS = ("day", "week", "month")
+
+
+def to_naive_utc(date: datetime) -> datetime:
+    """Returns the datetime in UTC without tzinfo, naive datetimes are taken as UTC"""
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
+
+
+def bucket_start(date: datetime, bucket: str) -> datetime:
+    """
+    Returns the start of the bucket the naive UTC datetime falls in, the same as
+    postgres date_trunc(bucket, date). Weeks start on Monday
+    """
+    day = date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+    if bucket == "day":
+        return day
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    raise ValueError(f"bucket must be one of {BUCKETS}")
+
+
+def next_bucket_start(start: datetime, bucket: str) -> datetime:
+    if bucket == "day":
+        return start + timedelta(days=1)
+    if bucket == "week":
+        return start + timedelta(weeks=1)
+    if bucket == "month":
+        year, month = divmod(start.month, 12)
+        return start.replace(year=start.year + year, month=month + 1)
+    raise ValueError(f"bucket must be one of {BUCKETS}")
+
+
+def bucket_starts(start: datetime, end: datetime, bucket: str) -> list[datetime]:
+    """Returns the starts of every bucket overlapping [start, end)"""
+    starts = []
+    current = bucket_start(start, bucket)
+
+    while current < end:
+        starts.append(current)
+        current = next_bucket_start(current, bucket)
+
+    return starts
@@ -0,0 +1,71 @@
+"""
+Latency of a 1,000 row list response on the three serialization paths
+
+- before: the route returns GetUsers, which FastAPI validates again against the
+  response_model and runs through jsonable_encoder into a JSONResponse
+- orjson: the same with ORJSONResponse, the app's default response class
+- trusted: the route returns trusted_response(GetUsers(...)), like the list routes
+
+The rows are transient User objects, so no database is needed. Run from the
+repository root: python -m benchmarks.list_serialization
+"""
+import timeit
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.testclient import TestClient
+
+from app.models import User
+from app.schema import user as u
+from app.utils.responses import trusted_response
+
+ROWS = 1000
+ROUNDS = 50
+
+users = [
+    User(
+        id=i,
+        first_name="First",
+        middle_name=None,
+        last_name=f"Last{i}",
+        phone=f"+2335{i:08d}",
+        email=f"user{i}@example.com",
+        image_url=None,
+        role="user",
+    )
+    for i in range(1, ROWS + 1)
+]
+
+app = FastAPI()
+
+
+def users_page() -> u.GetUsers:
+    return u.GetUsers(message="Success", data=users, next_cursor="abc")
+
+
+@app.get("/before", response_model=u.GetUsers, response_class=JSONResponse)
+def before():
+    return users_page()
+
+
+@app.get("/orjson", response_model=u.GetUsers, response_class=ORJSONResponse)
+def orjson():
+    return users_page()
+
+
+@app.get("/trusted", response_model=u.GetUsers)
+def trusted():
+    return trusted_response(users_page())
+
+
+def main():
+    client = TestClient(app)
+    bodies = {path: client.get(path).json() for path in ("/before", "/trusted")}
+    assert bodies["/before"] == bodies["/trusted"]
+
+    for path in ("/before", "/orjson", "/trusted"):
+        elapsed = timeit.timeit(lambda: client.get(path), number=ROUNDS) / ROUNDS
+        print(f"{path.lstrip('/'):8} {elapsed * 1e3:8.2f} ms per {ROWS} rows")
+
+
+if __name__ == "__main__":
+    main()
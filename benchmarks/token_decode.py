@@ -0,0 +1,36 @@
+"""
+Per-request cost of the get_token_payload dependency, with and without the cache
+
+Cold decodes clear the token cache first, like the first request with a token or
+jwt_cache_enabled=false. Warm decodes are served from the cache, like the
+requests after it. Run from the repository root: python -m benchmarks.token_decode
+"""
+import timeit
+
+from app.dependencies.auth import get_token_payload
+from app.utils.auth import create_access_token, token_cache
+
+ROUNDS = 10_000
+
+
+def cold_decode(token: str) -> dict:
+    token_cache.clear()
+    return get_token_payload(token)
+
+
+def main():
+    token = create_access_token({"my_id": 1})
+    get_token_payload(token)
+
+    cold = timeit.timeit(lambda: cold_decode(token), number=ROUNDS) / ROUNDS
+    token_cache.clear()
+    get_token_payload(token)
+    warm = timeit.timeit(lambda: get_token_payload(token), number=ROUNDS) / ROUNDS
+
+    print(f"cold decode: {cold * 1e6:8.2f} us/request")
+    print(f"warm decode: {warm * 1e6:8.2f} us/request")
+    print(f"saved:       {(cold - warm) * 1e6:8.2f} us/request ({cold / warm:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""add lookup indexes
+
+Revision ID: b3f1c2d4e5a6
+Revises: 48e39b34142e
+Create Date: 2023-06-02 10:41:07.512934
+
+"""
+from app.utils.migrations import execute_raw_sql
+
+
+# revision identifiers, used by Alembic.
+revision = "b3f1c2d4e5a6"
+down_revision = "48e39b34142e"
+branch_labels = None
+depends_on = None
+
+
+# The (fk, id) pairs serve both the fk filter and the keyset ORDER BY id of the
+# paginated list queries. bills_user_id_id_idx also answers the
+# "SELECT id FROM bills WHERE user_id = ..." subquery of the payments list with an
+# index only scan.
+def upgrade() -> None:
+    execute_raw_sql(
+        """
+            CREATE INDEX bills_user_id_id_idx ON bills (user_id, id);
+            CREATE INDEX payments_bill_id_id_idx ON payments (bill_id, id);
+            CREATE INDEX creditors_owner_id_id_idx ON creditors (owner_id, id);
+            CREATE INDEX users_otp_idx ON users (otp)
+                INCLUDE (otp_expires_at) WHERE otp IS NOT NULL;
+        """
+    )
+
+
+def downgrade() -> None:
+    execute_raw_sql(
+        """
+            DROP INDEX users_otp_idx;
+            DROP INDEX creditors_owner_id_id_idx;
+            DROP INDEX payments_bill_id_id_idx;
+            DROP INDEX bills_user_id_id_idx;
+        """
+    )
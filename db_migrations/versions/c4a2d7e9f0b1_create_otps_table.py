@@ -0,0 +1,64 @@
+"""create otps table
+
+Revision ID: c4a2d7e9f0b1
+Revises: b3f1c2d4e5a6
+Create Date: 2023-06-05 18:22:46.103527
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql.expression import func
+
+from app.utils.migrations import execute_raw_sql
+
+
+# revision identifiers, used by Alembic.
+revision = "c4a2d7e9f0b1"
+down_revision = "b3f1c2d4e5a6"
+branch_labels = None
+depends_on = None
+table = "otps"
+
+
+def upgrade() -> None:
+    op.create_table(
+        table,
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "user_id",
+            sa.Integer,
+            sa.ForeignKey("users.id", ondelete="CASCADE"),
+            nullable=False,
+        ),
+        sa.Column(
+            "purpose",
+            sa.Enum("login", "update_credentials", name="otps_purpose_enum"),
+            nullable=False,
+        ),
+        sa.Column("code_hash", sa.String(64), nullable=False, unique=True),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=True), server_default=func.now()),
+    )
+    op.create_index("otps_expires_at_idx", table, ["expires_at"])
+
+    # Codes still in flight are dropped, users request a new one
+    execute_raw_sql(
+        """
+            DROP INDEX users_otp_idx;
+            ALTER TABLE users DROP COLUMN otp, DROP COLUMN otp_expires_at;
+        """
+    )
+
+
+def downgrade() -> None:
+    execute_raw_sql(
+        """
+            ALTER TABLE users
+                ADD COLUMN otp VARCHAR,
+                ADD COLUMN otp_expires_at TIMESTAMP WITH TIME ZONE;
+            CREATE INDEX users_otp_idx ON users (otp)
+                INCLUDE (otp_expires_at) WHERE otp IS NOT NULL;
+        """
+    )
+    op.drop_table(table)
+    sa.Enum("login", "update_credentials", name="otps_purpose_enum").drop(op.get_bind())
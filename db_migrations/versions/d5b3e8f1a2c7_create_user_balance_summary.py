@@ -0,0 +1,168 @@
+"""create user balance summary
+
+Revision ID: d5b3e8f1a2c7
+Revises: c4a2d7e9f0b1
+Create Date: 2023-06-09 11:05:38.220461
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql.expression import func, text
+
+from app.utils.migrations import execute_raw_sql
+
+
+# revision identifiers, used by Alembic.
+revision = "d5b3e8f1a2c7"
+down_revision = "c4a2d7e9f0b1"
+branch_labels = None
+depends_on = None
+table = "user_balance_summary"
+
+
+def upgrade() -> None:
+    op.create_table(
+        table,
+        sa.Column(
+            "user_id",
+            sa.Integer,
+            sa.ForeignKey("users.id", ondelete="CASCADE"),
+            primary_key=True,
+        ),
+        sa.Column("total_credit", sa.Numeric(14, 2), server_default=text("0.00")),
+        sa.Column("total_paid", sa.Numeric(14, 2), server_default=text("0.00")),
+        sa.Column("outstanding", sa.Numeric(14, 2), server_default=text("0.00")),
+        sa.Column("open_bill_count", sa.Integer, server_default=text("0")),
+        sa.Column("last_payment_at", sa.DateTime(timezone=True)),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=func.now()),
+    )
+
+    # Every write to a bill's amounts moves the owner's summary by the difference
+    # between the bill's old and new contribution. Payments only reach the
+    # amounts through bills.total_paid_amount, so they just stamp last_payment_at.
+    execute_raw_sql(
+        """
+            CREATE FUNCTION user_balance_summary_add_bill(
+                bill_user_id INTEGER, credit NUMERIC, paid NUMERIC, sign INTEGER
+            ) RETURNS VOID LANGUAGE plpgsql AS $$
+            BEGIN
+                credit := COALESCE(credit, 0);
+                paid := COALESCE(paid, 0);
+
+                IF sign < 0 THEN
+                    -- The row exists since the bill was added, and updating rather
+                    -- than upserting is safe while a user delete cascades.
+                    UPDATE user_balance_summary SET
+                        total_credit = total_credit - credit,
+                        total_paid = total_paid - paid,
+                        outstanding = outstanding - GREATEST(credit - paid, 0),
+                        open_bill_count = open_bill_count - (paid < credit)::INTEGER,
+                        updated_at = now()
+                    WHERE user_id = bill_user_id;
+                ELSE
+                    INSERT INTO user_balance_summary AS s (
+                        user_id, total_credit, total_paid, outstanding, open_bill_count
+                    ) VALUES (
+                        bill_user_id,
+                        credit,
+                        paid,
+                        GREATEST(credit - paid, 0),
+                        (paid < credit)::INTEGER
+                    )
+                    ON CONFLICT (user_id) DO UPDATE SET
+                        total_credit = s.total_credit + EXCLUDED.total_credit,
+                        total_paid = s.total_paid + EXCLUDED.total_paid,
+                        outstanding = s.outstanding + EXCLUDED.outstanding,
+                        open_bill_count = s.open_bill_count + EXCLUDED.open_bill_count,
+                        updated_at = now();
+                END IF;
+            END;
+            $$;
+
+            CREATE FUNCTION bills_maintain_balance_summary()
+            RETURNS TRIGGER LANGUAGE plpgsql AS $$
+            BEGIN
+                IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                    PERFORM user_balance_summary_add_bill(
+                        OLD.user_id, OLD.total_credit_amount, OLD.total_paid_amount, -1
+                    );
+                END IF;
+
+                IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                    PERFORM user_balance_summary_add_bill(
+                        NEW.user_id, NEW.total_credit_amount, NEW.total_paid_amount, 1
+                    );
+                END IF;
+
+                RETURN NULL;
+            END;
+            $$;
+
+            CREATE TRIGGER bills_balance_summary_trg
+            AFTER INSERT OR DELETE
+                OR UPDATE OF user_id, total_credit_amount, total_paid_amount
+            ON bills
+            FOR EACH ROW EXECUTE FUNCTION bills_maintain_balance_summary();
+
+            CREATE FUNCTION payments_maintain_balance_summary()
+            RETURNS TRIGGER LANGUAGE plpgsql AS $$
+            BEGIN
+                UPDATE user_balance_summary AS s
+                SET last_payment_at = GREATEST(s.last_payment_at, latest.created_at)
+                FROM (
+                    SELECT bills.user_id, max(new_payments.created_at) AS created_at
+                    FROM new_payments JOIN bills ON bills.id = new_payments.bill_id
+                    GROUP BY bills.user_id
+                ) AS latest
+                WHERE s.user_id = latest.user_id;
+
+                RETURN NULL;
+            END;
+            $$;
+
+            -- Once per statement, so a batch of payments costs one update per user
+            CREATE TRIGGER payments_balance_summary_trg
+            AFTER INSERT ON payments
+            REFERENCING NEW TABLE AS new_payments
+            FOR EACH STATEMENT EXECUTE FUNCTION payments_maintain_balance_summary();
+
+            INSERT INTO user_balance_summary (
+                user_id, total_credit, total_paid, outstanding, open_bill_count,
+                last_payment_at
+            )
+            SELECT
+                bills.user_id,
+                sum(COALESCE(total_credit_amount, 0)),
+                sum(COALESCE(total_paid_amount, 0)),
+                sum(GREATEST(
+                    COALESCE(total_credit_amount, 0) - COALESCE(total_paid_amount, 0),
+                    0
+                )),
+                count(*) FILTER (
+                    WHERE COALESCE(total_paid_amount, 0)
+                        < COALESCE(total_credit_amount, 0)
+                ),
+                max(last_payments.created_at)
+            FROM bills
+            LEFT JOIN (
+                SELECT bill_id, max(created_at) AS created_at
+                FROM payments GROUP BY bill_id
+            ) AS last_payments ON last_payments.bill_id = bills.id
+            GROUP BY bills.user_id;
+        """
+    )
+
+
+def downgrade() -> None:
+    execute_raw_sql(
+        """
+            DROP TRIGGER payments_balance_summary_trg ON payments;
+            DROP TRIGGER bills_balance_summary_trg ON bills;
+            DROP FUNCTION payments_maintain_balance_summary();
+            DROP FUNCTION bills_maintain_balance_summary();
+            DROP FUNCTION user_balance_summary_add_bill(
+                INTEGER, NUMERIC, NUMERIC, INTEGER
+            );
+        """
+    )
+    op.drop_table(table)
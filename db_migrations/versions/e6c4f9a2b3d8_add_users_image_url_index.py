@@ -0,0 +1,30 @@
+"""add users image url index
+
+Revision ID: e6c4f9a2b3d8
+Revises: d5b3e8f1a2c7
+Create Date: 2023-06-12 09:17:44.604128
+
+"""
+from app.utils.migrations import execute_raw_sql
+
+
+# revision identifiers, used by Alembic.
+revision = "e6c4f9a2b3d8"
+down_revision = "d5b3e8f1a2c7"
+branch_labels = None
+depends_on = None
+
+
+# The image cleanup job asks which of a batch of stored image names are still
+# referenced by a user. Users without an image are left out of the index.
+def upgrade() -> None:
+    execute_raw_sql(
+        """
+            CREATE INDEX users_image_url_idx ON users (image_url)
+                WHERE image_url IS NOT NULL;
+        """
+    )
+
+
+def downgrade() -> None:
+    execute_raw_sql("DROP INDEX users_image_url_idx;")
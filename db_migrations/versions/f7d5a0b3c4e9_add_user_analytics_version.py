@@ -0,0 +1,74 @@
+"""add user analytics version
+
+Revision ID: f7d5a0b3c4e9
+Revises: e6c4f9a2b3d8
+Create Date: 2023-06-14 10:22:31.518207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.sql.expression import text
+
+from app.utils.migrations import execute_raw_sql
+
+
+# revision identifiers, used by Alembic.
+revision = "f7d5a0b3c4e9"
+down_revision = "e6c4f9a2b3d8"
+branch_labels = None
+depends_on = None
+table = "user_balance_summary"
+
+BILLS_MAINTAIN_BALANCE_SUMMARY = """
+    CREATE OR REPLACE FUNCTION bills_maintain_balance_summary()
+    RETURNS TRIGGER LANGUAGE plpgsql AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            PERFORM user_balance_summary_add_bill(
+                OLD.user_id, OLD.total_credit_amount, OLD.total_paid_amount, -1
+            );
+        END IF;
+
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            PERFORM user_balance_summary_add_bill(
+                NEW.user_id, NEW.total_credit_amount, NEW.total_paid_amount, 1
+            );
+        END IF;{bump_analytics_version}
+
+        RETURN NULL;
+    END;
+    $$;
+"""
+
+# Payments are only ever added to the current bucket, so past analytics change when
+# a bill takes its payments away from its user, or brings them to another one. The
+# app caches the analytics of past buckets per analytics_version. Bumped last, once
+# the new owner's summary row has been upserted for the bill.
+BUMP_ANALYTICS_VERSION = """
+
+        -- NEW is null on DELETE, OLD on INSERT
+        IF TG_OP = 'DELETE' OR NEW.user_id <> OLD.user_id THEN
+            UPDATE user_balance_summary
+            SET analytics_version = analytics_version + 1
+            WHERE user_id = OLD.user_id
+                OR (TG_OP = 'UPDATE' AND user_id = NEW.user_id);
+        END IF;"""
+
+
+def upgrade() -> None:
+    op.add_column(
+        table,
+        sa.Column(
+            "analytics_version", sa.Integer, server_default=text("0"), nullable=False
+        ),
+    )
+    execute_raw_sql(
+        BILLS_MAINTAIN_BALANCE_SUMMARY.format(
+            bump_analytics_version=BUMP_ANALYTICS_VERSION
+        )
+    )
+
+
+def downgrade() -> None:
+    execute_raw_sql(BILLS_MAINTAIN_BALANCE_SUMMARY.format(bump_analytics_version=""))
+    op.drop_column(table, "analytics_version")
@@ -0,0 +1,39 @@
+"""
+Past analytics are cached per user analytics_version, which the bills trigger
+must bump for every user whose past payments a bill write changes
+"""
+from tests.conftest import skip_without_database
+
+skip_without_database()
+
+from sqlalchemy import delete, select, update  # noqa: E402
+
+from app.models import Bill, UserBalanceSummary  # noqa: E402
+
+
+def analytics_version(db, user_id: int) -> int | None:
+    summary = UserBalanceSummary
+    stmt = select(summary.analytics_version).where(summary.user_id == user_id)
+    return db.scalar(stmt)
+
+
+def test_moving_a_bill_bumps_both_users(db, owner, other_user_id):
+    owner_version = analytics_version(db, owner.user_id)
+
+    db.execute(
+        update(Bill).where(Bill.id == owner.bill_id).values(user_id=other_user_id)
+    )
+    db.commit()
+
+    assert analytics_version(db, owner.user_id) == owner_version + 1
+    # The other user's summary row is created by the move
+    assert analytics_version(db, other_user_id) == 1
+
+
+def test_deleting_a_bill_bumps_its_user(db, owner):
+    owner_version = analytics_version(db, owner.user_id)
+
+    db.execute(delete(Bill).where(Bill.id == owner.bill_id))
+    db.commit()
+
+    assert analytics_version(db, owner.user_id) == owner_version + 1
@@ -0,0 +1,39 @@
+"""
+An otp only ever serves the user it was issued to
+
+Two users hold the same code at the same time, issued for different purposes, so
+both hashes are live. Consuming it for one user must leave the other's alone.
+"""
+from tests.conftest import skip_without_database
+
+skip_without_database()
+
+from sqlalchemy import select  # noqa: E402
+
+from app.crud.otps import OtpCrud  # noqa: E402
+from app.models import Otp  # noqa: E402
+from app.utils import auth as au  # noqa: E402
+
+CODE = "12345"
+PURPOSES = ["update_credentials", "login"]
+
+
+def live_otps(db, user_id: int) -> int:
+    return len(db.scalars(select(Otp.id).where(Otp.user_id == user_id)).all())
+
+
+def test_otp_is_only_consumed_for_its_user(db, owner, other_user_id, monkeypatch):
+    monkeypatch.setattr(au, "generate_otp", lambda num_of_digits: CODE)
+    OtpCrud.issue(db, owner.user_id, purpose="login")
+    OtpCrud.issue(db, other_user_id, purpose="update_credentials")
+
+    assert OtpCrud.consume(db, CODE, PURPOSES, other_user_id)
+    db.commit()
+    assert live_otps(db, other_user_id) == 0
+    assert live_otps(db, owner.user_id) == 1
+
+    # The code is spent for the other user, the owner's is still theirs to use
+    assert not OtpCrud.consume(db, CODE, PURPOSES, other_user_id)
+    assert OtpCrud.consume(db, CODE, PURPOSES, owner.user_id)
+    db.commit()
+    assert live_otps(db, owner.user_id) == 0
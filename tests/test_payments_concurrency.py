@@ -0,0 +1,63 @@
+"""
+Concurrent payments on one bill must never lose an update
+
+STRESS_WRITERS writers each record STRESS_PAYMENTS_PER_WRITER payments of 1.00 on
+the same bill, each writer on its own connection. The bill totals must add up to
+every payment recorded. Run with -s to see the payments/sec.
+"""
+import os
+import time
+import asyncio
+from decimal import Decimal
+from tests.conftest import skip_without_database, async_database_url
+
+skip_without_database()
+
+from sqlalchemy import func, select  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker  # noqa: E402
+
+from app.crud.payments import PaymentCrud  # noqa: E402
+from app.models import Bill, Payment  # noqa: E402
+from app.schema.bill_payment import PaymentCreate  # noqa: E402
+
+WRITERS = int(os.environ.get("STRESS_WRITERS", 20))
+PAYMENTS_PER_WRITER = int(os.environ.get("STRESS_PAYMENTS_PER_WRITER", 25))
+
+
+async def record_payments(bill_id: int) -> float:
+    """Runs the writers concurrently and returns how long they took"""
+    engine = create_async_engine(async_database_url(), pool_size=WRITERS)
+    Session = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    async def writer(issuer: str):
+        async with Session() as db:
+            for _ in range(PAYMENTS_PER_WRITER):
+                payment = PaymentCreate(bill_id=bill_id, issuer=issuer, amount=1.00)
+                await PaymentCrud.async_create(db, payment)
+
+    # Half the writers pay, the other half add credit, on the same bill row
+    issuers = ["user" if i % 2 else "creditor" for i in range(WRITERS)]
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(writer(issuer) for issuer in issuers))
+        return time.perf_counter() - started
+    finally:
+        await engine.dispose()
+
+
+def test_concurrent_payments_lose_no_update(db, owner, record_property):
+    elapsed = asyncio.run(record_payments(owner.bill_id))
+
+    bill = db.get(Bill, owner.bill_id)
+    payments = db.scalar(select(func.count()).where(Payment.bill_id == owner.bill_id))
+    paid_writers = WRITERS // 2
+    credit_writers = WRITERS - paid_writers
+
+    total = WRITERS * PAYMENTS_PER_WRITER
+    assert payments == total
+    assert bill.total_paid_amount == Decimal(paid_writers * PAYMENTS_PER_WRITER)
+    assert bill.total_credit_amount == Decimal(credit_writers * PAYMENTS_PER_WRITER)
+
+    rate = total / elapsed
+    record_property("payments_per_sec", round(rate, 1))
+    print(f"\n{total} payments by {WRITERS} writers: {rate:.1f} payments/sec")
@@ -0,0 +1,103 @@
+"""
+The nested responses must load in a fixed number of queries
+
+Each endpoint is requested once to cache the logged-in user, then again while the
+statements sent to the database are counted. The user has several bills and the
+bill several payments, so a relationship left to lazy loading would add queries
+per row, or fail outright on the async session.
+"""
+import uuid
+from decimal import Decimal
+from tests.conftest import skip_without_database, async_database_url, unique_phone
+
+skip_without_database()
+
+import pytest  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+from sqlalchemy.pool import NullPool  # noqa: E402
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app.main import app  # noqa: E402
+from app.crud.users import user_cache  # noqa: E402
+from app.models import Bill, Creditor, Payment  # noqa: E402
+from app.utils.auth import create_access_token  # noqa: E402
+from app.utils.database import async_db_init  # noqa: E402
+
+EXTRA_BILLS = 3
+PAYMENTS = 3
+
+
+@pytest.fixture
+def counted_client(owner):
+    """A client of the app on the test database and the list of its statements"""
+    # Connections aren't pooled, the client runs the app on its own event loop
+    engine = create_async_engine(async_database_url(), poolclass=NullPool)
+    Session = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    statements = []
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    async def test_db_init():
+        async with Session() as db:
+            yield db
+
+    app.dependency_overrides[async_db_init] = test_db_init
+    user_cache.clear()
+    token = create_access_token({"my_id": owner.user_id})
+    client = TestClient(app, headers={"Authorization": f"Bearer {token}"})
+
+    yield client, statements
+
+    app.dependency_overrides.pop(async_db_init)
+    user_cache.clear()
+
+
+@pytest.fixture
+def payment_id(db, owner):
+    """Adds bills and payments to the owner's, returns the id of a payment"""
+    for _ in range(EXTRA_BILLS):
+        creditor = Creditor(
+            owner_id=owner.user_id,
+            name=f"Test Creditor {uuid.uuid4().hex}",
+            city="Lagos",
+            state="Lagos",
+            phone=unique_phone(),
+        )
+        db.add(creditor)
+        db.flush()
+        db.add(Bill(user_id=owner.user_id, creditor_id=creditor.id))
+
+    payments = [
+        Payment(bill_id=owner.bill_id, issuer="creditor", amount=Decimal("1.00"))
+        for _ in range(PAYMENTS)
+    ]
+    db.add_all(payments)
+    db.commit()
+    return payments[0].id
+
+
+ENDPOINTS = {
+    # The user with a selectinload of their bills
+    "/api/v1/me/": 2,
+    # The owner check, the bill and a selectinload of its payments
+    "/api/v1/bills/{bill_id}": 3,
+    # The owner check and the payment joined to its bill
+    "/api/v1/payments/{payment_id}": 2,
+}
+
+
+@pytest.mark.parametrize("endpoint", ENDPOINTS)
+def test_nested_response_query_count(counted_client, owner, payment_id, endpoint):
+    client, statements = counted_client
+    url = endpoint.format(bill_id=owner.bill_id, payment_id=payment_id)
+
+    assert client.get(url).status_code == 200  # Caches the logged-in user
+    statements.clear()
+
+    response = client.get(url)
+
+    assert response.status_code == 200, response.text
+    assert len(statements) == ENDPOINTS[endpoint], "\n".join(statements)
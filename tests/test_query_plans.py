@@ -0,0 +1,87 @@
+"""
+The per-user lookups must stay answerable from their indexes
+
+Each query is EXPLAINed with sequential scans disabled, which makes the planner
+use an index whenever one can serve the query. A plan that still scans the table
+means a change to the query or the indexes left it without a usable index.
+"""
+import json
+from tests.conftest import skip_without_database
+
+skip_without_database()
+
+import pytest  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+from sqlalchemy.dialects import postgresql  # noqa: E402
+
+from app.crud.bills import BillCrud  # noqa: E402
+from app.crud.creditors import CreditorCrud  # noqa: E402
+from app.crud.otps import OtpCrud  # noqa: E402
+from app.crud.payments import PaymentCrud  # noqa: E402
+from app.utils.pagination import Page  # noqa: E402
+
+PAGE_PARAMS = {"id": 1, "after_id": 0, "limit": Page().fetch_size}
+
+
+def compiled(stmt) -> tuple[str, dict]:
+    """The statement as pyformat sql and parameters, like the raw queries"""
+    query = stmt.compile(
+        dialect=postgresql.psycopg2.dialect(),
+        compile_kwargs={"render_postcompile": True},
+    )
+    return str(query), query.params
+
+
+def plan_nodes(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def explain(db, query: str, params: dict) -> list[dict]:
+    db.execute(text("SET LOCAL enable_seqscan = off"))
+    with db.connection().connection.cursor() as cur:
+        cur.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+        plan = cur.fetchone()[0]
+    db.rollback()
+
+    plan = json.loads(plan) if isinstance(plan, str) else plan
+    return list(plan_nodes(plan[0]["Plan"]))
+
+
+QUERIES = {
+    # The payments side may be walked through payments_pkey for the ORDER BY id
+    # instead of payments_bill_id_id_idx, depending on the table statistics
+    "my payments page": (
+        lambda: (PaymentCrud.user_payments_query(), PAGE_PARAMS),
+        {"bills_user_id_id_idx"},
+    ),
+    "my creditors page": (
+        lambda: (CreditorCrud.user_creditors_query(), PAGE_PARAMS),
+        {"creditors_owner_id_id_idx"},
+    ),
+    "my bills page": (
+        lambda: compiled(BillCrud.bills_page_for_user_stmt(1, Page())),
+        {"bills_user_id_id_idx"},
+    ),
+    "otp consume": (
+        lambda: compiled(OtpCrud.consume_stmt("123456", ["login"])),
+        {"otps_code_hash_key"},
+    ),
+    "otp purge": (
+        lambda: compiled(OtpCrud.purge_expired_stmt(1000)),
+        {"otps_expires_at_idx"},
+    ),
+}
+
+
+@pytest.mark.parametrize("name", QUERIES)
+def test_lookup_uses_its_indexes(db, name):
+    build_query, expected_indexes = QUERIES[name]
+    nodes = explain(db, *build_query())
+
+    seq_scans = [n["Relation Name"] for n in nodes if n["Node Type"] == "Seq Scan"]
+    used_indexes = {n["Index Name"] for n in nodes if "Index Name" in n}
+
+    assert seq_scans == [], f"{name} scans {seq_scans}"
+    assert expected_indexes <= used_indexes, f"{name} uses {used_indexes}"